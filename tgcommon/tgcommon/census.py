@@ -0,0 +1,262 @@
+"""
+Row counts for every tgschema table, and a check of the models (columns and indexes) against the live schema
+
+Works on any aiomysql pool so it can run from inside TGDB or from a plain script, counts go out
+concurrently but never on more than concurrency connections at once
+"""
+
+import asyncio
+import time
+from collections import namedtuple
+
+from .models import tgschema
+
+TableCount = namedtuple("TableCount", "table, rows, seconds, approximate, error")
+TableCount.__new__.__defaults__ = (False, None)
+
+TableDrift = namedtuple(
+    "TableDrift", "table, missing_table, missing_columns, extra_columns"
+)
+
+# An index something expects to find, columns in index order
+IndexSpec = namedtuple("IndexSpec", "table, name, columns, unique")
+IndexSpec.__new__.__defaults__ = (False,)
+
+
+def schema_tables(tables=None):
+    """
+    The tgschema tables to work on, every one of them if no names are given
+    """
+    if tables is None:
+        return list(tgschema.metadata.tables.values())
+    return [tgschema.metadata.tables[name] for name in tables]
+
+
+async def count_table(pool, table: str, prefix: str = ""):
+    """
+    Exact row count of one table, errors (a missing table, a timeout) are reported on the result rather than raised
+    """
+    started = time.perf_counter()
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT COUNT(*) FROM `{prefix}{table}`")
+                (rows,) = await cur.fetchone()
+    except Exception as e:
+        return TableCount(table, None, time.perf_counter() - started, error=str(e))
+    return TableCount(table, rows, time.perf_counter() - started)
+
+
+async def count_tables(
+    pool, prefix: str = "", tables=None, concurrency: int = 4, approximate=False
+):
+    """
+    Row counts for the tgschema tables, largest first
+
+    Exact counts run COUNT(*) on up to concurrency connections at once, which on InnoDB still means a full index scan
+    of each table. The approximate mode reads the optimizer's estimates from information_schema.TABLES in a single query
+    instead, every count then carries that one query's time
+    """
+    names = [table.name for table in schema_tables(tables)]
+    if approximate:
+        counts = await estimate_tables(pool, names, prefix)
+    else:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(name):
+            async with semaphore:
+                return await count_table(pool, name, prefix)
+
+        counts = await asyncio.gather(*(bounded(name) for name in names))
+    return sorted(counts, key=lambda count: count.rows or 0, reverse=True)
+
+
+async def estimate_tables(pool, names, prefix: str = ""):
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT TABLE_NAME, TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN %s",
+                (tuple(f"{prefix}{name}" for name in names),),
+            )
+            estimates = dict(await cur.fetchall())
+    elapsed = time.perf_counter() - started
+    counts = []
+    for name in names:
+        if f"{prefix}{name}" in estimates:
+            counts.append(TableCount(name, estimates[f"{prefix}{name}"], elapsed, True))
+        else:
+            counts.append(TableCount(name, None, elapsed, True, "Table does not exist"))
+    return counts
+
+
+async def live_columns(pool, names, prefix: str = ""):
+    """
+    The columns of each of the named tables as the database has them, tables that don't exist are left out
+    """
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN %s "
+                "ORDER BY TABLE_NAME, ORDINAL_POSITION",
+                (tuple(f"{prefix}{name}" for name in names),),
+            )
+            rows = await cur.fetchall()
+    columns = {}
+    for table, column in rows:
+        columns.setdefault(table[len(prefix) :], []).append(column)
+    return columns
+
+
+async def validate_models(pool, prefix: str = "", tables=None):
+    """
+    Compare the tgschema models with the live schema, returning a TableDrift for every table that doesn't match
+    """
+    models = schema_tables(tables)
+    live = await live_columns(pool, [table.name for table in models], prefix)
+    drift = []
+    for table in models:
+        columns = live.get(table.name)
+        if columns is None:
+            drift.append(TableDrift(table.name, True, (), ()))
+            continue
+        declared = [column.name for column in table.columns]
+        missing = tuple(column for column in declared if column not in columns)
+        extra = tuple(column for column in columns if column not in declared)
+        if missing or extra:
+            drift.append(TableDrift(table.name, False, missing, extra))
+    return drift
+
+
+def declared_indexes(tables=None):
+    """
+    Every index the tgschema models declare, primary keys included
+    """
+    specs = []
+    for table in schema_tables(tables):
+        if table.primary_key.columns:
+            specs.append(
+                IndexSpec(
+                    table.name,
+                    "PRIMARY",
+                    tuple(column.name for column in table.primary_key.columns),
+                    True,
+                )
+            )
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            specs.append(
+                IndexSpec(
+                    table.name,
+                    index.name,
+                    tuple(column.name for column in index.columns),
+                    bool(index.unique),
+                )
+            )
+    return specs
+
+
+async def live_indexes(pool, names, prefix: str = ""):
+    """
+    The indexes on each of the named tables as the database has them, {table: {index name: (columns...)}}
+    """
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN %s "
+                "ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX",
+                (tuple(f"{prefix}{name}" for name in names),),
+            )
+            rows = await cur.fetchall()
+    indexes = {}
+    for table, index, column in rows:
+        table_indexes = indexes.setdefault(table[len(prefix) :], {})
+        table_indexes[index] = table_indexes.get(index, ()) + (column,)
+    return indexes
+
+
+def covers(columns, spec: IndexSpec):
+    """
+    Whether an index on columns can serve lookups the spec's index is there for, it has to lead with the same columns
+    """
+    return tuple(columns[: len(spec.columns)]) == spec.columns
+
+
+async def missing_indexes(pool, specs, prefix: str = ""):
+    """
+    The specs with no matching index in the database, an index matches if it has the same name and columns
+    or any name and leads with the spec's columns. Specs on tables that don't exist are left out
+    """
+    live = await live_indexes(pool, sorted({spec.table for spec in specs}), prefix)
+    missing = []
+    for spec in specs:
+        indexes = live.get(spec.table)
+        if indexes is None:
+            continue
+        if indexes.get(spec.name) == spec.columns:
+            continue
+        if any(covers(columns, spec) for columns in indexes.values()):
+            continue
+        missing.append(spec)
+    return missing
+
+
+def index_ddl(spec: IndexSpec, prefix: str = ""):
+    """
+    The statement that adds this index
+    """
+    columns = ", ".join(f"`{column}`" for column in spec.columns)
+    if spec.name == "PRIMARY":
+        return f"ALTER TABLE `{prefix}{spec.table}` ADD PRIMARY KEY ({columns});"
+    kind = "UNIQUE INDEX" if spec.unique else "INDEX"
+    return f"ALTER TABLE `{prefix}{spec.table}` ADD {kind} `{spec.name}` ({columns});"
+
+
+def format_census(counts, drift=()):
+    """
+    Plain text report of a census, one line per table
+    """
+    width = max((len(count.table) for count in counts), default=0)
+    lines = []
+    for count in counts:
+        if count.error:
+            result = f"error: {count.error}"
+        else:
+            result = f"{'~' if count.approximate else ''}{count.rows:,}"
+        lines.append(
+            f"{count.table:<{width}} {result:>15} {count.seconds * 1000:8.0f}ms"
+        )
+    if counts:
+        lines.append(
+            f"{len(counts)} tables, {sum(count.rows or 0 for count in counts):,} rows"
+        )
+    for table in drift:
+        if table.missing_table:
+            lines.append(f"{table.table}: missing from the database")
+            continue
+        if table.missing_columns:
+            lines.append(
+                f"{table.table}: missing columns {', '.join(table.missing_columns)}"
+            )
+        if table.extra_columns:
+            lines.append(
+                f"{table.table}: columns not in the model {', '.join(table.extra_columns)}"
+            )
+    return "\n".join(lines)
+
+
+def format_indexes(missing, prefix: str = "", ddl=False, label=""):
+    """
+    Plain text report of missing indexes, with the DDL to add each one if asked for
+    """
+    lines = []
+    for spec in missing:
+        suffix = f" ({label})" if label else ""
+        lines.append(
+            f"{spec.table}: missing index {spec.name} on {', '.join(spec.columns)}{suffix}"
+        )
+        if ddl:
+            lines.append(f"    {index_ddl(spec, prefix)}")
+    return "\n".join(lines)
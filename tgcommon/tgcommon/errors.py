@@ -10,3 +10,12 @@ class TGRecoverableError(commands.CheckFailure):
 
 class TGUnrecoverableError(commands.CheckFailure):
     pass
+
+class TGDatabaseUnavailableError(TGRecoverableError):
+    pass
+
+class TGPoolExhaustedError(TGRecoverableError):
+    pass
+
+class TGQueryTimeoutError(TGRecoverableError):
+    pass
@@ -0,0 +1,55 @@
+"""
+Models that map to database tables in tgstation database schema
+TODO: investigate SQL alchemy for this?
+"""
+import ipaddress
+from collections import namedtuple
+
+BaseLink = namedtuple(
+    "DiscordLink", "id, ckey, discord_id, timestamp, one_time_token, valid"
+)
+
+
+class DiscordLink(BaseLink):
+    @classmethod
+    def from_db_record(cls, record):
+        # Unpack it
+        return cls(**record)
+
+    @classmethod
+    def from_db_row(cls, row):
+        # Tuple straight off the cursor, the query has to select the columns in field order
+        return cls._make(row)
+
+    @property
+    def validity(self):
+        if self.valid > 0:
+            return True
+        return False
+
+
+BasePlayerProfile = namedtuple(
+    "PlayerProfile", "ckey, ip, cid, first, last, join, living_time, ghost_time"
+)
+
+
+class PlayerProfile(BasePlayerProfile):
+    __slots__ = ()
+
+    @classmethod
+    def from_db_record(cls, record):
+        return cls(
+            record["ckey"],
+            # IP's are stored as a 32 bit integer, converting it for readability
+            ipaddress.IPv4Address(record["ip"]),
+            record["computerid"],
+            record["firstseen"],
+            record["lastseen"],
+            record["accountjoindate"],
+            int(record["living_time"]),
+            int(record["ghost_time"]),
+        )
+
+    @property
+    def total_time(self):
+        return self.living_time + self.ghost_time
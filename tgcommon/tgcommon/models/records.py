@@ -0,0 +1,86 @@
+"""
+A record class for every table in tgschema, generated from the Table definitions
+
+Records are namedtuples with empty __slots__, so a row costs one tuple no matter how many are held,
+fields are the table's columns in schema order
+
+    records.Ban, records.ConnectionLog, records.Round, records.for_table("role_time")
+"""
+
+from collections import namedtuple
+from operator import itemgetter
+
+from . import tgschema
+
+
+class Record(tuple):
+    """
+    Shared factories for the generated record classes
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_db_record(cls, record):
+        # Dict row, extra keys are ignored
+        return cls._make(map(record.__getitem__, cls._fields))
+
+    @classmethod
+    def from_db_row(cls, row):
+        # Tuple straight off the cursor, the query has to select the columns in field order
+        return cls._make(row)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        A list of records from a result set of tuples, rows carrying their column names (tgdb's Rows) are
+        reordered to the record's fields if the query selected them in some other order
+        """
+        columns = getattr(rows, "columns", None)
+        if columns is None or tuple(columns) == cls._fields:
+            return list(map(cls._make, rows))
+        if len(cls._fields) == 1:
+            position = rows.index[cls._fields[0]]
+            return [cls._make((row[position],)) for row in rows]
+        getter = itemgetter(*(rows.index[field] for field in cls._fields))
+        return [cls._make(getter(row)) for row in rows]
+
+
+def class_name(table_name: str):
+    return "".join(part.capitalize() for part in table_name.split("_"))
+
+
+def record_class(table):
+    """
+    Build the record class for a SQLAlchemy Table
+    """
+    fields = tuple(column.name for column in table.columns)
+    name = class_name(table.name)
+    return type(
+        name,
+        (namedtuple(f"Base{name}", fields), Record),
+        {
+            "__slots__": (),
+            "__doc__": f"A row of the {table.name} table",
+            "table": table.name,
+            # The columns in field order, ready to drop into a SELECT
+            "columns": ", ".join(fields),
+        },
+    )
+
+
+RECORDS = {
+    name: record_class(table) for name, table in tgschema.metadata.tables.items()
+}
+globals().update({record.__name__: record for record in RECORDS.values()})
+
+__all__ = ["Record", "RECORDS", "for_table", "record_class"] + [
+    record.__name__ for record in RECORDS.values()
+]
+
+
+def for_table(name: str):
+    """
+    The record class for a table, by its real (unprefixed) name
+    """
+    return RECORDS[name]
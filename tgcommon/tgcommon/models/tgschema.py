@@ -417,7 +417,7 @@ ticket = Table("ticket", metadata,
 discord_links = Table("discord_links", metadata,
     Column("id", INTEGER(11, unsigned = True), nullable = False, autoincrement = True),
     Column("ckey", VARCHAR(32), nullable = False),
-    Column("discord_id", BIGINT(20), nullable = TRUE, default= None),
+    Column("discord_id", BIGINT(20), nullable = True, default= None),
     Column("timestamp", DATETIME(), nullable = False),
     Column("one_time_token", VARCHAR(100), nullable=False),
     Column("valid", BOOLEAN(), nullable=False, default=False),
@@ -1,4 +1,16 @@
 import re
+from itertools import islice
 
 def normalise_to_ckey(key):
 	return re.sub('[^A-Za-z0-9]+', '', key)
+
+def chunked(iterable, size):
+	"""
+	Split an iterable into lists of at most size items
+	"""
+	iterator = iter(iterable)
+	while True:
+		chunk = list(islice(iterator, size))
+		if not chunk:
+			return
+		yield chunk
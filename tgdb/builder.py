@@ -0,0 +1,177 @@
+# Standard Imports
+import logging
+import re
+from collections import namedtuple
+
+from sqlalchemy import MetaData
+from sqlalchemy.dialects.mysql import pymysql as mysql_pymysql
+
+from tgcommon.models import tgschema
+
+from .statements import is_read_query, with_execution_hint
+
+log = logging.getLogger("red.oranges_tgdb.builder")
+
+# pyformat lets the compiled SQL go straight to cursor.execute with a dict of parameters
+DIALECT = mysql_pymysql.dialect(paramstyle="pyformat")
+
+# An expanding bindparam (column.in_(bindparam("ckeys", expanding=True))) compiles to a placeholder that
+# SQLAlchemy fills in per call, pymysql renders a tuple parameter as a parenthesised list so plain %(name)s does the job
+EXPANDING = re.compile(r"\(?__\[POSTCOMPILE_(\w+)\]\)?|\(?\[EXPANDING_(\w+)\]\)?")
+
+
+class PrefixedSchema:
+    """
+    Every tgschema table renamed for one table prefix, looked up by the real table name
+
+        schema.ban, schema["round"], schema.discord_links.c.ckey
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.metadata = MetaData()
+        self.tables = {
+            name: table.to_metadata(self.metadata, name=f"{prefix}{name}")
+            for name, table in tgschema.metadata.tables.items()
+        }
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def __getattr__(self, name):
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class CompiledQuery(namedtuple("CompiledQuery", "sql defaults readonly")):
+    """
+    The SQL for a built query along with the values of any literals bound in the expression
+    """
+
+    __slots__ = ()
+
+    def parameters(self, values: dict = None):
+        """
+        The defaults with the caller's values over them, lists become tuples for IN. An empty list is a ValueError,
+        IN () isn't valid SQL so the caller has to skip the query instead
+        """
+        parameters = dict(self.defaults)
+        if values:
+            for name, value in values.items():
+                if isinstance(value, list):
+                    if not value:
+                        raise ValueError(
+                            f"{name} is an empty list, there is nothing to match IN against"
+                        )
+                    value = tuple(value)
+                parameters[name] = value
+        return parameters
+
+
+class Query:
+    """
+    A named Core expression, build is called with a PrefixedSchema and returns the statement to compile
+    """
+
+    __slots__ = ("name", "build", "timeout")
+
+    def __init__(self, name: str, build, timeout: float = None):
+        self.name = name
+        self.build = build
+        self.timeout = timeout
+
+    def deadline(self, limit: float):
+        if self.timeout is None:
+            return limit
+        return min(self.timeout, limit)
+
+
+class QueryBuilder:
+    """
+    Queries written as SQLAlchemy Core expressions over tgschema, compiled once per table prefix
+
+        tgdb.queries.register(
+            "recent_bans",
+            lambda t: select(t.ban).where(t.ban.c.ckey == bindparam("ckey")).order_by(t.ban.c.bantime.desc()).limit(10),
+        )
+        rows = await tgdb.run_query(ctx, "recent_bans", {"ckey": ckey})
+
+    Values the caller passes in are named bindparams, an expanding bindparam takes a non-empty list for IN.
+    Unlike statements a query can be registered again under the same name, so a dependent cog can be reloaded
+    """
+
+    def __init__(self):
+        self.queries = {}
+        self._schemas = {}
+        self._compiled = {}
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, name: str, build, timeout: float = None):
+        if name in self.queries:
+            self._compiled = {
+                key: compiled
+                for key, compiled in self._compiled.items()
+                if key[0] != name
+            }
+        query = Query(name, build, timeout)
+        self.queries[name] = query
+        return query
+
+    def __contains__(self, name):
+        return name in self.queries
+
+    def __iter__(self):
+        return iter(self.queries.values())
+
+    def __getitem__(self, name):
+        return self.queries[name]
+
+    def schema(self, prefix: str):
+        schema = self._schemas.get(prefix)
+        if schema is None:
+            schema = self._schemas[prefix] = PrefixedSchema(prefix)
+        return schema
+
+    def compile(self, name: str, prefix: str, timeout: float = None):
+        """
+        Return the CompiledQuery for this query against the given prefix, reads also get a server side execution
+        time limit of timeout seconds if one is given
+        """
+        key = (name, prefix, timeout)
+        compiled = self._compiled.get(key)
+        if compiled is not None:
+            self.hits += 1
+            return compiled
+
+        self.misses += 1
+        expression = self.queries[name].build(self.schema(prefix))
+        result = expression.compile(dialect=DIALECT)
+        sql = EXPANDING.sub(lambda m: f"%({m.group(1) or m.group(2)})s", str(result))
+        readonly = is_read_query(sql)
+        if readonly and timeout:
+            sql = with_execution_hint(sql, timeout)
+        # Bindparams without a value are the caller's to fill in, a literal None (SET x = NULL) is kept
+        compiled = CompiledQuery(
+            sql,
+            {
+                param: value
+                for param, value in result.params.items()
+                if not result.binds[param].required
+            },
+            readonly,
+        )
+        log.debug(f"Compiled query {name} for prefix {prefix!r}: {sql}")
+        self._compiled[key] = compiled
+        return compiled
+
+    def stats(self):
+        return {
+            "queries": len(self.queries),
+            "compiled": len(self._compiled),
+            "schemas": len(self._schemas),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
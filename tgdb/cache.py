@@ -0,0 +1,108 @@
+# Standard Imports
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+log = logging.getLogger("red.oranges_tgdb.cache")
+
+
+class TTLCache:
+    """
+    LRU cache whose entries expire after ttl seconds
+
+    Concurrent lookups of the same missing key share one load instead of each going to the database,
+    and a load that was running when its key got invalidated won't put its (now stale) answer in the cache.
+    Invalidating one key leaves the loads for every other key alone
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._inflight = {}
+        # Predicates from invalidate_where calls made while a key was loading, checked against its answer
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, or await loader() to fetch it
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # Shielded so one caller giving up doesn't cancel the load for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        try:
+            value = await loader()
+            # Not ours to cache if the key was invalidated (and maybe reloaded) while we were at it
+            current = self._inflight.get(key) is asyncio.current_task()
+            if current and not any(
+                predicate(key, value) for predicate in self._pending.get(key, ())
+            ):
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+                self._pending.pop(key, None)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+        self._pending.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """
+        Drop every entry where predicate(key, value) is true
+
+        A load in flight is dropped if predicate(key, None) is true, the next lookup starts a fresh one.
+        Otherwise it carries on and its answer is only cached if the predicate is false for it too
+        """
+        for key, (_, value) in list(self._entries.items()):
+            if predicate(key, value):
+                del self._entries[key]
+        for key in list(self._inflight):
+            if predicate(key, None):
+                self.invalidate(key)
+            else:
+                self._pending.setdefault(key, []).append(predicate)
+
+    def clear(self):
+        self._entries.clear()
+        self._inflight.clear()
+        self._pending.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,152 @@
+# Standard Imports
+import bisect
+import logging
+import time
+from collections import Counter, deque
+
+log = logging.getLogger("red.oranges_tgdb.metrics")
+
+# Upper bounds of the histogram buckets in milliseconds, anything slower lands in the overflow bucket
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    """
+    Fixed bucket latency histogram, constant memory no matter how many samples it sees
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q: float):
+        """
+        Upper bound of the bucket holding the q'th percentile sample, never more than the max (which is also the
+        answer for the overflow bucket)
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index < len(BUCKETS_MS):
+                    return float(min(BUCKETS_MS[index], self.max))
+                return self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max,
+        }
+
+
+class QueryTimings:
+    """
+    Where the time went for one query template, waiting for a connection, executing and fetching
+    """
+
+    __slots__ = ("acquire", "execute", "fetch", "total")
+
+    def __init__(self):
+        self.acquire = Histogram()
+        self.execute = Histogram()
+        self.fetch = Histogram()
+        self.total = Histogram()
+
+    def summary(self):
+        return {
+            "acquire": self.acquire.summary(),
+            "execute": self.execute.summary(),
+            "fetch": self.fetch.summary(),
+            "total": self.total.summary(),
+        }
+
+
+class Metrics:
+    """
+    Query timings per template, error counts and a log of the most recent slow queries
+
+    Operations made of several queries (a whole verify, say) get a histogram of their own under record,
+    they never reach the slow query log, their queries already do if they are slow
+    """
+
+    def __init__(self, slow_query_ms: float = 500, slow_log_size: int = 50):
+        self.slow_query_ms = slow_query_ms
+        self.timings = {}
+        self.operations = {}
+        self.errors = Counter()
+        self.slow_queries = deque(maxlen=slow_log_size)
+
+    def observe(self, name: str, acquire: float, execute: float, fetch: float = 0.0):
+        """
+        Record one query, the timings are in seconds as they come off perf_counter
+        """
+        timings = self.timings.get(name)
+        if timings is None:
+            timings = self.timings[name] = QueryTimings()
+        acquire, execute, fetch = acquire * 1000, execute * 1000, fetch * 1000
+        total = acquire + execute + fetch
+        timings.acquire.observe(acquire)
+        timings.execute.observe(execute)
+        timings.fetch.observe(fetch)
+        timings.total.observe(total)
+
+        if total >= self.slow_query_ms:
+            self.slow_queries.append(
+                {
+                    "name": name,
+                    "at": time.time(),
+                    "acquire_ms": acquire,
+                    "execute_ms": execute,
+                    "fetch_ms": fetch,
+                    "total_ms": total,
+                }
+            )
+            log.warning(
+                f"Slow query {name}: {total:.0f}ms (acquire {acquire:.0f}ms, execute {execute:.0f}ms, fetch {fetch:.0f}ms)"
+            )
+
+    def record(self, name: str, seconds: float):
+        """
+        Record how long one operation took, in seconds
+        """
+        histogram = self.operations.get(name)
+        if histogram is None:
+            histogram = self.operations[name] = Histogram()
+        histogram.observe(seconds * 1000)
+
+    def record_error(self, name: str, error: BaseException):
+        self.errors[type(error).__name__] += 1
+        log.debug(f"Query {name} failed with {type(error).__name__}: {error}")
+
+    def snapshot(self):
+        return {
+            "queries": {name: t.summary() for name, t in self.timings.items()},
+            "operations": {name: h.summary() for name, h in self.operations.items()},
+            "errors": dict(self.errors),
+            "slow_queries": list(self.slow_queries),
+            "slow_query_ms": self.slow_query_ms,
+        }
+
+    def reset(self):
+        self.timings.clear()
+        self.operations.clear()
+        self.errors.clear()
+        self.slow_queries.clear()
@@ -0,0 +1,117 @@
+# Standard Imports
+import json
+import logging
+import time
+from collections import namedtuple
+
+log = logging.getLogger("red.oranges_tgdb.plans")
+
+# One table's part of a plan, how it is read and through which index
+TableAccess = namedtuple("TableAccess", "table, access_type, key, rows")
+
+# What EXPLAIN said about one statement, flags are the problems found in the plan
+PlanSnapshot = namedtuple("PlanSnapshot", "name, taken, flags, cost, access, plan")
+
+
+def walk(node):
+    """
+    Every dict in a parsed EXPLAIN FORMAT=JSON plan, depth first
+    """
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from walk(value)
+
+
+def analyse(plan: dict):
+    """
+    The flags and table accesses in a plan, handles both the MySQL and the MariaDB flavour of the JSON
+    """
+    flags = []
+    access = []
+    for node in walk(plan):
+        table = node.get("table_name")
+        access_type = node.get("access_type")
+        if table and access_type:
+            access.append(
+                TableAccess(
+                    table,
+                    access_type,
+                    node.get("key"),
+                    node.get("rows_examined_per_scan", node.get("rows")),
+                )
+            )
+            if access_type == "ALL":
+                flags.append(f"full scan of {table}")
+        if node.get("using_filesort") or "filesort" in node:
+            flags.append("filesort")
+        if node.get("using_temporary_table") or "temporary_table" in node:
+            flags.append("temporary table")
+    cost = plan.get("query_block", {}).get("cost_info", {}).get("query_cost")
+    return list(dict.fromkeys(flags)), access, float(cost) if cost else None
+
+
+def snapshot(name: str, raw: str):
+    """
+    Build a PlanSnapshot from the JSON string EXPLAIN FORMAT=JSON returned
+    """
+    plan = json.loads(raw)
+    flags, access, cost = analyse(plan)
+    return PlanSnapshot(name, time.time(), tuple(flags), cost, tuple(access), plan)
+
+
+def to_stored(plan: PlanSnapshot):
+    """
+    The part of a snapshot worth keeping in Config, the full plan is left out
+    """
+    return {
+        "taken": plan.taken,
+        "flags": list(plan.flags),
+        "cost": plan.cost,
+        "access": [list(access) for access in plan.access],
+    }
+
+
+def regressions(plan: PlanSnapshot, stored: dict):
+    """
+    How this plan got worse compared with a stored one, new flags or a table read through a different index
+    """
+    if not stored:
+        return []
+    changes = [
+        f"new {flag}" for flag in plan.flags if flag not in stored.get("flags", ())
+    ]
+    before = {
+        table: (access_type, key)
+        for table, access_type, key, _ in stored.get("access", ())
+    }
+    for access in plan.access:
+        old = before.get(access.table)
+        if old and old != (access.access_type, access.key):
+            changes.append(
+                f"{access.table} was {old[0]} on {old[1]}, now {access.access_type} on {access.key}"
+            )
+    return changes
+
+
+def format_plans(plans, stored=None):
+    """
+    Plain text report of a set of plans, one line per statement plus any problems and regressions under it
+    """
+    stored = stored or {}
+    lines = []
+    for plan in plans:
+        tables = ", ".join(
+            f"{access.table}:{access.access_type}/{access.key or '-'}"
+            for access in plan.access
+        )
+        cost = f" cost {plan.cost:g}" if plan.cost is not None else ""
+        lines.append(f"{plan.name}{cost} [{tables}]")
+        for flag in plan.flags:
+            lines.append(f"    ! {flag}")
+        for change in regressions(plan, stored.get(plan.name)):
+            lines.append(f"    REGRESSION {change}")
+    return "\n".join(lines)
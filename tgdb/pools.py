@@ -0,0 +1,275 @@
+# Standard Imports
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from collections import namedtuple
+from contextlib import asynccontextmanager
+
+import aiomysql
+import pymysql
+
+from tgcommon.errors import TGPoolExhaustedError, TGQueryTimeoutError
+
+log = logging.getLogger("red.oranges_tgdb.pools")
+
+# Everything that makes two pools incompatible, guilds resolving to the same key share a pool
+PoolKey = namedtuple(
+    "PoolKey",
+    "host, port, db, user, password, minsize, maxsize, recycle",
+    defaults=(1, 10, 300),
+)
+
+
+@asynccontextmanager
+async def acquire(pool, timeout: float):
+    """
+    Check a connection out of the pool, giving up with TGPoolExhaustedError if none frees up within timeout seconds
+    """
+    try:
+        conn = await asyncio.wait_for(pool.acquire(), timeout)
+    except asyncio.TimeoutError:
+        raise TGPoolExhaustedError(
+            f"All {pool.maxsize} database connections are busy, please try again in a few seconds"
+        )
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+# MySQL's MAX_EXECUTION_TIME and MariaDB's max_statement_time errors, the server killed the query for running too long
+SERVER_TIMEOUT_CODES = frozenset((3024, 1969))
+
+# Extra time the client waits past a server side execution limit before it gives up on the connection itself
+CLIENT_GRACE = 1.0
+
+
+async def execute(conn, cur, query: str, parameters, timeout: float):
+    """
+    Execute on the cursor, abandoning the query if it runs past timeout seconds
+
+    An abandoned connection is still busy with the query server side, so it is closed rather than going back to the pool.
+    Either way the caller gets a TGQueryTimeoutError
+    """
+    try:
+        return await asyncio.wait_for(cur.execute(query, parameters), timeout)
+    except asyncio.TimeoutError:
+        conn.close()
+        raise TGQueryTimeoutError(
+            f"The database took longer than {timeout:g}s to answer, please try again"
+        )
+    except pymysql.err.OperationalError as e:
+        if e.args and e.args[0] in SERVER_TIMEOUT_CODES:
+            # The server gave up on the query by itself, the connection is fine to reuse
+            raise TGQueryTimeoutError(
+                "The database took too long to answer, please try again"
+            ) from e
+        raise
+
+
+class HostResolver:
+    """
+    Resolves database hostnames without blocking the event loop, caching answers for ttl seconds
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._cache = {}
+
+    async def resolve(self, host: str):
+        try:
+            # Already an address, nothing to look up
+            return str(ipaddress.ip_address(host))
+        except ValueError:
+            pass
+
+        cached = self._cache.get(host)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        loop = asyncio.get_running_loop()
+        try:
+            answers = await loop.getaddrinfo(
+                host, None, family=socket.AF_INET, type=socket.SOCK_STREAM
+            )
+        except socket.gaierror:
+            if cached:
+                # DNS is having a bad day, the last answer we had is better than nothing
+                log.warning(
+                    f"Failed to resolve {host}, reusing the expired answer {cached[0]}"
+                )
+                return cached[0]
+            raise
+
+        address = answers[0][4][0]
+        self._cache[host] = (address, time.monotonic() + self.ttl)
+        return address
+
+    def clear(self):
+        self._cache.clear()
+
+
+class PoolEntry:
+    """
+    A pool in the registry, and when it was last handed out
+    """
+
+    __slots__ = ("pool", "last_used")
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.last_used = time.monotonic()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    @property
+    def in_use(self):
+        return self.pool.size - self.pool.freesize
+
+
+class PoolRegistry:
+    """
+    Holds one aiomysql pool per distinct set of connection parameters
+
+    Pools are created the first time a key is asked for, and closed again by evict_idle once nothing
+    has used them for a while
+    """
+
+    def __init__(self, idle_timeout=600):
+        self.idle_timeout = idle_timeout
+        self._entries = {}
+        self._locks = {}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def items(self):
+        return [(key, entry.pool) for key, entry in self._entries.items()]
+
+    def gauges(self):
+        """
+        Size, in use and free connection counts for every open pool
+        """
+        return [
+            {
+                "pool": f"{key.user}@{key.host}:{key.port}/{key.db}",
+                "minsize": entry.pool.minsize,
+                "maxsize": entry.pool.maxsize,
+                "size": entry.pool.size,
+                "in_use": entry.in_use,
+                "free": entry.pool.freesize,
+                "idle_seconds": time.monotonic() - entry.last_used,
+            }
+            for key, entry in self._entries.items()
+        ]
+
+    async def get(self, key: PoolKey):
+        """
+        Return the pool for this key, creating it if we don't have one yet
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            # Only one caller gets to create the pool, everyone else waits for it
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = PoolEntry(await self._create(key))
+                    self._entries[key] = entry
+        entry.touch()
+        return entry.pool
+
+    async def replace(self, key: PoolKey):
+        """
+        Open a fresh pool for this key and swap it in, then close the old one (if any)
+
+        The old pool is closed after the swap, so queries still running on it finish while new ones already
+        go to the new pool
+        """
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = PoolEntry(await self._create(key))
+            old = self._entries.get(key)
+            self._entries[key] = entry
+        if old:
+            await self._close(old.pool)
+        return entry.pool
+
+    async def warm(self, key: PoolKey):
+        """
+        Make sure the pool for this key exists with its minimum connections open, and ping each of them
+
+        At least one connection is opened and pinged even with a minsize of 0, so a warm pool means the
+        database really answered
+        """
+        pool = await self.get(key)
+        connections = []
+        try:
+            for _ in range(max(1, pool.minsize)):
+                connections.append(await pool.acquire())
+            await asyncio.gather(*(conn.ping() for conn in connections))
+        finally:
+            for conn in connections:
+                pool.release(conn)
+        return pool
+
+    @asynccontextmanager
+    async def dedicated(self, key: PoolKey, maxsize: int):
+        """
+        A pool of its own for this key with up to maxsize connections, kept out of the registry and closed on exit,
+        for long running work that shouldn't tie up the connections everything else shares
+        """
+        pool = await self._create(key._replace(minsize=0, maxsize=maxsize))
+        try:
+            yield pool
+        finally:
+            await self._close(pool)
+
+    async def evict_idle(self):
+        """
+        Close every pool that has no connections checked out and has not been used within the idle timeout
+        """
+        now = time.monotonic()
+        for key, entry in list(self._entries.items()):
+            if entry.in_use == 0 and now - entry.last_used >= self.idle_timeout:
+                log.debug(
+                    f"Evicting idle pool for {key.user}@{key.host}:{key.port}/{key.db}"
+                )
+                del self._entries[key]
+                self._locks.pop(key, None)
+                await self._close(entry.pool)
+
+    async def close_all(self):
+        entries = list(self._entries.values())
+        self._entries.clear()
+        self._locks.clear()
+        for entry in entries:
+            await self._close(entry.pool)
+
+    async def _create(self, key: PoolKey):
+        log.info(f"Opening pool for {key.user}@{key.host}:{key.port}/{key.db}")
+        # Establish a connection with the database and pull the relevant data, recycling connections as configured
+        # Connections autocommit so plain reads never need a COMMIT. Multi statements stay off, so nothing sent
+        # down a pooled connection can stack a second statement onto the first
+        return await aiomysql.create_pool(
+            host=key.host,
+            port=key.port,
+            db=key.db,
+            user=key.user,
+            password=key.password,
+            minsize=key.minsize,
+            maxsize=key.maxsize,
+            connect_timeout=5,
+            pool_recycle=key.recycle,
+            autocommit=True,
+        )
+
+    async def _close(self, pool):
+        pool.close()
+        await pool.wait_closed()
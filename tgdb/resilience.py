@@ -0,0 +1,83 @@
+# Standard Imports
+import logging
+import random
+import time
+
+import pymysql
+
+from tgcommon.errors import TGDatabaseUnavailableError
+
+log = logging.getLogger("red.oranges_tgdb.resilience")
+
+# Client and server error codes that mean the connection itself is broken rather than the query being wrong
+# 1040 too many connections, 1053 server shutdown, 2003 can't connect, 2006 server gone away,
+# 2013 lost connection during query, 2055 lost connection at system error
+CONNECTION_ERROR_CODES = frozenset((1040, 1053, 2003, 2006, 2013, 2055))
+
+
+def is_connection_error(error: BaseException):
+    """
+    Is this error the connection failing (worth retrying on a fresh connection) rather than the query failing
+    """
+    if isinstance(error, (ConnectionError, pymysql.err.InterfaceError)):
+        return True
+    if isinstance(error, pymysql.err.OperationalError) and error.args:
+        return error.args[0] in CONNECTION_ERROR_CODES
+    return False
+
+
+def backoff_delay(attempt: int, base: float = 0.1, cap: float = 2.0):
+    """
+    Full jitter exponential backoff, a random delay between zero and base * 2^attempt (at most cap) seconds
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class CircuitBreaker:
+    """
+    Trips open after failure_threshold connection failures in a row, while open every call fails immediately
+    instead of queueing up behind a database that isn't there
+
+    Once reset_timeout has passed calls are let through again, one success closes the breaker and one more
+    failure opens it straight back up
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return (
+            self.opened_at is not None
+            and time.monotonic() - self.opened_at < self.reset_timeout
+        )
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "open" if self.is_open else "half-open"
+
+    def check(self):
+        if self.is_open:
+            raise TGDatabaseUnavailableError(
+                "The database is currently unreachable, please try again in a little while"
+            )
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if not self.is_open:
+                log.warning(
+                    f"Opening circuit breaker after {self.failures} connection failures"
+                )
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        if self.opened_at is not None:
+            log.info("Closing circuit breaker, the database is reachable again")
+        self.failures = 0
+        self.opened_at = None
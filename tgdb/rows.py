@@ -0,0 +1,21 @@
+class Rows(list):
+    """
+    Query results as plain tuples, with the column positions worked out once for the whole result set
+    instead of a dict per row
+    """
+
+    def __init__(self, columns, rows):
+        super().__init__(rows)
+        self.columns = columns
+        self.index = {column: position for position, column in enumerate(columns)}
+
+    @classmethod
+    def from_cursor(cls, cursor, rows):
+        return cls(tuple(column[0] for column in cursor.description or ()), rows)
+
+    def column(self, name: str):
+        """
+        Every value in the named column
+        """
+        position = self.index[name]
+        return [row[position] for row in self]
@@ -0,0 +1,64 @@
+# Standard Imports
+import logging
+import time
+
+log = logging.getLogger("red.oranges_tgdb.snapshots")
+
+
+class TableSnapshot:
+    """
+    Every row of a small table held in memory as records, indexed by primary key
+
+    Lookups on other columns build their index the first time they are asked for, the snapshot never changes
+    once built so the indexes never go stale. version is whatever the table's change check returned when it was loaded
+    """
+
+    __slots__ = ("table", "records", "key_columns", "version", "loaded", "_indexes")
+
+    def __init__(self, table: str, records: list, key_columns, version):
+        self.table = table
+        self.records = records
+        self.key_columns = tuple(key_columns)
+        self.version = version
+        self.loaded = time.time()
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def get(self, *key):
+        """
+        The record with this primary key, None if there isn't one
+        """
+        return self.index(*self.key_columns).get(key, [None])[0]
+
+    def find(self, **values):
+        """
+        Every record matching all the given column values, snapshot.find(rank="Game Master")
+        """
+        columns = tuple(sorted(values))
+        return self.index(*columns).get(tuple(values[c] for c in columns), [])
+
+    def index(self, *columns):
+        """
+        {values of columns: [records]} for the given columns, built once per set of columns
+        """
+        index = self._indexes.get(columns)
+        if index is None:
+            index = {}
+            for record in self.records:
+                key = tuple(getattr(record, column) for column in columns)
+                index.setdefault(key, []).append(record)
+            self._indexes[columns] = index
+        return index
+
+    def stats(self):
+        return {
+            "table": self.table,
+            "rows": len(self.records),
+            "version": str(self.version),
+            "age_seconds": time.time() - self.loaded,
+        }
@@ -0,0 +1,119 @@
+# Standard Imports
+import logging
+import re
+
+log = logging.getLogger("red.oranges_tgdb.statements")
+
+READ_VERBS = ("SELECT", "SHOW", "EXPLAIN", "DESCRIBE", "WITH", "CHECKSUM")
+
+
+def is_read_query(query: str):
+    """
+    Does this query only read, and so can skip the commit on an autocommit connection
+    """
+    return query.lstrip().split(None, 1)[0].upper() in READ_VERBS
+
+
+LEADING_SELECT = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+
+def with_execution_hint(query: str, timeout: float):
+    """
+    Add a MAX_EXECUTION_TIME optimizer hint to a SELECT so the server kills it once it runs past timeout seconds
+
+    MySQL only honours the hint on the outermost SELECT, MariaDB ignores it as a comment, anything else is
+    returned untouched
+    """
+    if not timeout or "MAX_EXECUTION_TIME" in query:
+        return query
+    return LEADING_SELECT.sub(
+        f"SELECT /*+ MAX_EXECUTION_TIME({int(timeout * 1000)}) */", query, count=1
+    )
+
+
+class Statement:
+    """
+    A named SQL template, {prefix} in the template is replaced by the guild's table prefix
+
+    timeout is how many seconds the statement is expected to need at most, None leaves it to the guild's query timeout.
+    sample is a representative set of parameters, used to EXPLAIN the statement
+    """
+
+    __slots__ = ("name", "template", "readonly", "timeout", "sample")
+
+    def __init__(
+        self, name: str, template: str, timeout: float = None, sample: list = None
+    ):
+        self.name = name
+        self.template = template
+        self.readonly = is_read_query(template)
+        self.timeout = timeout
+        self.sample = sample
+
+    def deadline(self, limit: float):
+        """
+        How long this statement may run for, its own timeout but never more than the limit
+        """
+        if self.timeout is None:
+            return limit
+        return min(self.timeout, limit)
+
+    def render(self, prefix: str, timeout: float = None):
+        sql = self.template.format(prefix=prefix)
+        if self.readonly and timeout:
+            sql = with_execution_hint(sql, timeout)
+        return sql
+
+
+class StatementRegistry:
+    """
+    Holds every query template TGDB runs, rendering each one only once per table prefix
+    """
+
+    def __init__(self):
+        self.statements = {}
+        self._rendered = {}
+        self.hits = 0
+        self.misses = 0
+
+    def register(
+        self, name: str, template: str, timeout: float = None, sample: list = None
+    ):
+        if name in self.statements:
+            raise KeyError(f"A statement named {name} is already registered")
+        statement = Statement(name, template, timeout, sample)
+        self.statements[name] = statement
+        return statement
+
+    def __contains__(self, name):
+        return name in self.statements
+
+    def __iter__(self):
+        return iter(self.statements.values())
+
+    def __getitem__(self, name):
+        return self.statements[name]
+
+    def render(self, name: str, prefix: str, timeout: float = None):
+        """
+        Return the SQL for this statement with the given prefix applied, reads also get a server side execution
+        time limit of timeout seconds if one is given
+        """
+        key = (name, prefix, timeout)
+        sql = self._rendered.get(key)
+        if sql is not None:
+            self.hits += 1
+            return sql
+
+        self.misses += 1
+        sql = self.statements[name].render(prefix, timeout)
+        self._rendered[key] = sql
+        return sql
+
+    def stats(self):
+        return {
+            "statements": len(self.statements),
+            "rendered": len(self._rendered),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
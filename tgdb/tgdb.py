@@ -1,10 +1,11 @@
 # Standard Imports
 import asyncio
 import aiomysql
-import socket
-import ipaddress
 import re
 import logging
+import time
+from collections import namedtuple
+from contextlib import asynccontextmanager
 
 # Discord Imports
 import discord
@@ -13,10 +14,49 @@ import discord
 from redbot.core import commands, checks, Config
 from redbot.core.utils.chat_formatting import pagify, box, humanize_list, warning
 from redbot.core.utils.menus import menu, DEFAULT_CONTROLS
+from sqlalchemy import select
 
-from tgcommon.models import DiscordLink
-from tgcommon.errors import TGRecoverableError, TGUnrecoverableError
+from tgcommon.census import (
+    IndexSpec,
+    count_tables,
+    declared_indexes,
+    format_census,
+    format_indexes,
+    missing_indexes,
+    validate_models,
+)
+from tgcommon.models import DiscordLink, PlayerProfile, records, tgschema
+from tgcommon.errors import (
+    TGRecoverableError,
+    TGUnrecoverableError,
+    TGDatabaseUnavailableError,
+    TGPoolExhaustedError,
+)
+from tgcommon.util import chunked
 
+from .builder import QueryBuilder
+from .cache import TTLCache
+from .metrics import Metrics
+from .plans import format_plans, snapshot, to_stored
+from .pools import (
+    CLIENT_GRACE,
+    HostResolver,
+    PoolKey,
+    PoolRegistry,
+    acquire,
+    execute,
+)
+from .resilience import CircuitBreaker, backoff_delay, is_connection_error
+from .rows import Rows
+from .snapshots import TableSnapshot
+from .statements import StatementRegistry, is_read_query, with_execution_hint
+from .transactions import Transaction
+
+# How many keys go into a single IN (...) lookup, keeps the packet well under max_allowed_packet
+BULK_CHUNK_SIZE = 500
+
+# Reads are idempotent, so a read that hits a broken connection gets this many goes in total
+READ_ATTEMPTS = 3
 
 __version__ = "1.0.0"
 __author__ = ["crossedfall", "oranges"]
@@ -25,6 +65,144 @@ log = logging.getLogger("red.oranges_tgdb")
 
 BaseCog = getattr(commands, "Cog", object)
 
+DEFAULT_GUILD = {
+    "mysql_host": "127.0.0.1",
+    "mysql_port": 3306,
+    "mysql_user": "ss13",
+    "mysql_password": "password",
+    "mysql_db": "database",
+    "mysql_prefix": "",
+    "min_living_minutes": 60,
+    "verified_role": None,
+    "warm_up_on_load": True,
+    "check_schema_on_load": False,
+    "pool_minsize": 1,
+    "pool_maxsize": 10,
+    "pool_recycle": 300,
+    "acquire_timeout": 5.0,
+    "query_timeout": 10.0,
+}
+
+# In memory snapshot of a guild's config, so the query paths don't have to go back to Config every time
+GuildSettings = namedtuple("GuildSettings", DEFAULT_GUILD.keys())
+
+# discord_links columns in DiscordLink field order, so rows from a tuple cursor map straight onto the model
+DISCORD_LINK_COLUMNS = ", ".join(DiscordLink._fields)
+
+# Seconds a statement may run before the server kills it, capped by the guild's query timeout.
+# Point lookups are index hits and should be near instant, the bulk lookups scan a whole chunk of keys
+POINT_TIMEOUT = 3.0
+BULK_TIMEOUT = 10.0
+
+# Representative parameters, only used to EXPLAIN the statements
+SAMPLE_CKEY = "sampleckey"
+SAMPLE_DISCORD_ID = 100000000000000000
+SAMPLE_TOKEN = "sampletoken"
+
+# Every query TGDB runs, rendered once per table prefix
+STATEMENTS = StatementRegistry()
+STATEMENTS.register(
+    "update_discord_link",
+    "UPDATE {prefix}discord_links SET discord_id = %s, valid = TRUE WHERE one_time_token = %s AND timestamp >= Now() - INTERVAL 4 HOUR AND discord_id IS NULL",
+    timeout=POINT_TIMEOUT,
+    sample=[SAMPLE_DISCORD_ID, SAMPLE_TOKEN],
+)
+STATEMENTS.register(
+    "lookup_ckey_by_token",
+    "SELECT ckey FROM {prefix}discord_links WHERE one_time_token = %s AND timestamp >= Now() - INTERVAL 4 HOUR AND discord_id IS NULL ORDER BY timestamp DESC LIMIT 1",
+    timeout=POINT_TIMEOUT,
+    sample=[SAMPLE_TOKEN],
+)
+STATEMENTS.register(
+    "discord_link_for_discord_id",
+    f"SELECT {DISCORD_LINK_COLUMNS} FROM {{prefix}}discord_links WHERE discord_id = %s AND ckey IS NOT NULL ORDER BY timestamp DESC LIMIT 1",
+    timeout=POINT_TIMEOUT,
+    sample=[SAMPLE_DISCORD_ID],
+)
+STATEMENTS.register(
+    "discord_link_for_ckey",
+    f"SELECT {DISCORD_LINK_COLUMNS} FROM {{prefix}}discord_links WHERE ckey = %s AND discord_id IS NOT NULL ORDER BY timestamp DESC LIMIT 1",
+    timeout=POINT_TIMEOUT,
+    sample=[SAMPLE_CKEY],
+)
+STATEMENTS.register(
+    "clear_all_valid_discord_links_for_ckey",
+    "UPDATE {prefix}discord_links SET valid = FALSE WHERE ckey = %s AND valid = TRUE",
+    timeout=POINT_TIMEOUT,
+    sample=[SAMPLE_CKEY],
+)
+STATEMENTS.register(
+    "clear_all_valid_discord_links_for_discord_id",
+    "UPDATE {prefix}discord_links SET valid = FALSE WHERE discord_id = %s AND valid = TRUE",
+    timeout=POINT_TIMEOUT,
+    sample=[SAMPLE_DISCORD_ID],
+)
+STATEMENTS.register(
+    "all_discord_links_for_ckey",
+    f"SELECT {DISCORD_LINK_COLUMNS} FROM {{prefix}}discord_links WHERE ckey = %s AND discord_id IS NOT NULL ORDER BY TIMESTAMP desc",
+    timeout=BULK_TIMEOUT,
+    sample=[SAMPLE_CKEY],
+)
+# IN %s takes a tuple parameter, pymysql escapes it into a parenthesised list
+STATEMENTS.register(
+    "discord_links_for_discord_ids",
+    f"SELECT {DISCORD_LINK_COLUMNS} FROM {{prefix}}discord_links WHERE discord_id IN %s AND ckey IS NOT NULL ORDER BY timestamp DESC",
+    timeout=BULK_TIMEOUT,
+    sample=[(SAMPLE_DISCORD_ID, SAMPLE_DISCORD_ID + 1)],
+)
+STATEMENTS.register(
+    "discord_links_for_ckeys",
+    f"SELECT {DISCORD_LINK_COLUMNS} FROM {{prefix}}discord_links WHERE ckey IN %s AND discord_id IS NOT NULL ORDER BY timestamp DESC",
+    timeout=BULK_TIMEOUT,
+    sample=[(SAMPLE_CKEY, "othersample")],
+)
+STATEMENTS.register(
+    "living_minutes_for_ckeys",
+    "SELECT ckey, minutes FROM {prefix}role_time WHERE job = 'Living' AND ckey IN %s",
+    timeout=BULK_TIMEOUT,
+    sample=[(SAMPLE_CKEY, "othersample")],
+)
+# role_time is keyed on (ckey, job) so each of the minute lookups is a primary key hit
+STATEMENTS.register(
+    "get_player_by_ckey",
+    "SELECT p.ckey, p.firstseen, p.lastseen, p.computerid, p.ip, p.accountjoindate, "
+    "COALESCE((SELECT r.minutes FROM {prefix}role_time r WHERE r.ckey = p.ckey AND r.job = 'Living'), 0) AS living_time, "
+    "COALESCE((SELECT r.minutes FROM {prefix}role_time r WHERE r.ckey = p.ckey AND r.job = 'Ghost'), 0) AS ghost_time "
+    "FROM {prefix}player p WHERE p.ckey = %s",
+    timeout=POINT_TIMEOUT,
+    sample=[SAMPLE_CKEY],
+)
+# lookup_ckey_by_token and get_player_by_ckey in one round trip, the player columns are NULL if the token's ckey
+# has never connected
+STATEMENTS.register(
+    "player_by_token",
+    "SELECT l.ckey AS link_ckey, p.ckey, p.firstseen, p.lastseen, p.computerid, p.ip, p.accountjoindate, "
+    "COALESCE((SELECT r.minutes FROM {prefix}role_time r WHERE r.ckey = l.ckey AND r.job = 'Living'), 0) AS living_time, "
+    "COALESCE((SELECT r.minutes FROM {prefix}role_time r WHERE r.ckey = l.ckey AND r.job = 'Ghost'), 0) AS ghost_time "
+    "FROM {prefix}discord_links l LEFT JOIN {prefix}player p ON p.ckey = l.ckey "
+    "WHERE l.one_time_token = %s AND l.timestamp >= Now() - INTERVAL 4 HOUR AND l.discord_id IS NULL "
+    "ORDER BY l.timestamp DESC LIMIT 1",
+    timeout=POINT_TIMEOUT,
+    sample=[SAMPLE_TOKEN],
+)
+
+# Tables small and static enough to keep whole in memory, loaded by table_snapshot
+SNAPSHOT_TABLES = ("admin", "admin_ranks", "achievement_metadata")
+# How long a snapshot is used before checking whether its table changed
+# The check is a CHECKSUM TABLE, cheap on tables this size. information_schema UPDATE_TIME can't be trusted for it,
+# InnoDB only tracks it in memory so it reads NULL until the table is next written after a restart, and MySQL 8
+# serves it from a cache that can be information_schema_stats_expiry (a day by default) out of date
+SNAPSHOT_TTL = 300
+
+# Indexes the statements above rely on, without them every verify and link lookup scans the whole table
+HOT_INDEXES = (
+    IndexSpec("discord_links", "idx_discord_links_token", ("one_time_token",)),
+    IndexSpec("discord_links", "idx_discord_links_discord_id", ("discord_id",)),
+    IndexSpec("discord_links", "idx_discord_links_ckey", ("ckey",)),
+    IndexSpec("role_time", "PRIMARY", ("ckey", "job"), True),
+    IndexSpec("player", "PRIMARY", ("ckey",), True),
+)
+
 
 class TGDB(BaseCog):
     """
@@ -44,21 +222,96 @@ class TGDB(BaseCog):
             "mysql_prefix",
             "min_living_minutes",
             "verified_role",
+            "warm_up_on_load",
+            "check_schema_on_load",
+            "pool_minsize",
+            "pool_maxsize",
+            "pool_recycle",
+            "acquire_timeout",
+            "query_timeout",
         ]
 
-        default_guild = {
-            "mysql_host": "127.0.0.1",
-            "mysql_port": 3306,
-            "mysql_user": "ss13",
-            "mysql_password": "password",
-            "mysql_db": "database",
-            "mysql_prefix": "",
-            "min_living_minutes": 60,
-            "verified_role": None,
-        }
+        self.config.register_guild(**DEFAULT_GUILD)
+        # Plan snapshots from tgdb explain, keyed by database and prefix since that's what a plan depends on
+        self.config.register_global(slow_query_ms=500, plan_snapshots={})
+        self._settings = {}
+        self.statements = STATEMENTS
+        # Core expression queries over tgschema, other cogs register their own on here
+        self.queries = QueryBuilder()
+        # Latest discord link by discord id and by ckey, writes through TGDB drop the affected entries
+        self.link_cache = TTLCache(ttl=60, maxsize=4096)
+        # Whole table snapshots, the cache decides when to recheck and _snapshots keeps the last one to compare against
+        self.snapshot_cache = TTLCache(ttl=SNAPSHOT_TTL, maxsize=256)
+        self._snapshots = {}
+        self.resolver = HostResolver(ttl=300)
+        self.pools = PoolRegistry(idle_timeout=600)
+        self.metrics = Metrics()
+        self.breakers = {}
+        self._recoveries = {}
+        self._reaper = self.bot.loop.create_task(self.reap_idle_pools())
+        self._startup = self.bot.loop.create_task(self.initialize())
+
+    def cog_unload(self):
+        self._startup.cancel()
+        self._reaper.cancel()
+        for task in self._recoveries.values():
+            task.cancel()
+        self.bot.loop.create_task(self.pools.close_all())
+
+    async def initialize(self):
+        self.metrics.slow_query_ms = await self.config.slow_query_ms()
+        await self.bot.wait_until_red_ready()
+        await self.warm_up_pools()
+        await self.check_schemas()
+
+    async def warm_up_pools(self):
+        """
+        Open and health check the pool for every configured guild, so the first query after a restart doesn't pay for it
+        """
+        for guild_id in await self.config.all_guilds():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            settings = await self.settings_for_guild(guild)
+            if not settings.warm_up_on_load:
+                continue
+            try:
+                await self.pools.warm(await self.pool_key_for_guild(guild))
+                log.info(f"Database pool warmed up for {guild.name}")
+            except Exception:
+                log.exception(f"Failed to warm up the database pool for {guild.name}")
+
+    async def check_schemas(self):
+        """
+        Log any schema drift or missing indexes for every guild that has the check on load turned on
+        """
+        for guild_id in await self.config.all_guilds():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            settings = await self.settings_for_guild(guild)
+            if not settings.check_schema_on_load:
+                continue
+            try:
+                report = await self.schema_report(guild, ddl=True)
+            except Exception:
+                log.exception(f"Failed to check the database schema for {guild.name}")
+                continue
+            if report:
+                log.warning(f"Database schema problems for {guild.name}:\n{report}")
+            else:
+                log.info(f"Database schema matches tgschema for {guild.name}")
 
-        self.config.register_guild(**default_guild)
-        self.pool = None
+    async def reap_idle_pools(self):
+        """
+        Periodically close pools that no guild has used in a while
+        """
+        while True:
+            await asyncio.sleep(60)
+            try:
+                await self.pools.evict_idle()
+            except Exception:
+                log.exception("Failed to evict idle database pools")
 
     @commands.guild_only()
     @commands.group()
@@ -78,6 +331,153 @@ class TGDB(BaseCog):
         """
         pass
 
+    @tgdb.command()
+    async def stats(self, ctx):
+        """
+        Show query latency, pool usage, errors, slow queries and cache hit rates
+        """
+        stats = self.get_stats()
+        lines = [
+            "Queries (ms)                          count    p50    p99  acq99    max"
+        ]
+        for name, timings in sorted(
+            stats["queries"].items(), key=lambda item: -item[1]["total"]["count"]
+        ):
+            total = timings["total"]
+            lines.append(
+                f"{name[:36]:<36} {total['count']:>6} {total['p50_ms']:>6.0f} {total['p99_ms']:>6.0f} "
+                f"{timings['acquire']['p99_ms']:>6.0f} {total['max_ms']:>6.0f}"
+            )
+
+        if stats["operations"]:
+            lines.append("")
+            lines.append(
+                "Operations (ms)                       count    p50    p99    max"
+            )
+            for name, total in sorted(
+                stats["operations"].items(), key=lambda item: -item[1]["count"]
+            ):
+                lines.append(
+                    f"{name[:36]:<36} {total['count']:>6} {total['p50_ms']:>6.0f} {total['p99_ms']:>6.0f} "
+                    f"{total['max_ms']:>6.0f}"
+                )
+
+        lines.append("")
+        lines.append("Pools")
+        for pool in stats["pools"]:
+            lines.append(
+                f"{pool['pool']}: {pool['in_use']} in use, {pool['free']} free, "
+                f"{pool['size']}/{pool['maxsize']} open, idle {pool['idle_seconds']:.0f}s"
+            )
+
+        for breaker in stats["breakers"]:
+            if breaker["state"] != "closed":
+                lines.append(
+                    f"{breaker['pool']}: circuit {breaker['state']} after {breaker['failures']} failures"
+                )
+
+        lines.append("")
+        lines.append("Errors")
+        for error, count in sorted(stats["errors"].items(), key=lambda item: -item[1]):
+            lines.append(f"{error}: {count}")
+
+        lines.append("")
+        lines.append(f"Slow queries (>= {stats['slow_query_ms']}ms)")
+        for slow in stats["slow_queries"][-10:]:
+            lines.append(
+                f"{slow['name']}: {slow['total_ms']:.0f}ms (acquire {slow['acquire_ms']:.0f}, "
+                f"execute {slow['execute_ms']:.0f}, fetch {slow['fetch_ms']:.0f})"
+            )
+
+        links = stats["link_cache"]
+        statements = stats["statements"]
+        lines.append("")
+        lines.append(
+            f"Link cache: {links['size']} entries, {links['hits']} hits, {links['misses']} misses, "
+            f"{links['coalesced']} coalesced, {links['hit_rate']:.1%} hit rate"
+        )
+        lines.append(
+            f"Statements: {statements['statements']} registered, {statements['rendered']} rendered, "
+            f"{statements['hits']} hits, {statements['misses']} misses"
+        )
+        queries = stats["query_builder"]
+        lines.append(
+            f"Queries: {queries['queries']} registered, {queries['compiled']} compiled, "
+            f"{queries['hits']} hits, {queries['misses']} misses"
+        )
+        for page in pagify("\n".join(lines)):
+            await ctx.send(box(page))
+
+    @tgdb.command()
+    async def slowlog(self, ctx, threshold_ms: int):
+        """
+        Sets how long a query has to take, in milliseconds, before it is logged as slow, defaults to 500
+        """
+        await self.config.slow_query_ms.set(threshold_ms)
+        self.metrics.slow_query_ms = threshold_ms
+        await ctx.send(f"Slow query threshold set to: `{threshold_ms}ms`")
+
+    @tgdb.command()
+    async def census(self, ctx, approximate: bool = False):
+        """
+        Count the rows in every table and check the tgschema models against the database
+
+        Pass true for approximate to use the database's row estimates, which comes back instantly where exact
+        counts of the log tables can take minutes
+        """
+        async with ctx.typing():
+            counts, drift = await self.table_census(ctx, approximate)
+        for page in pagify(format_census(counts, drift)):
+            await ctx.send(box(page))
+
+    @tgdb.command()
+    async def schema(self, ctx, ddl: bool = False):
+        """
+        Check the database's tables, columns and indexes against tgschema, pass true to also get the DDL for missing indexes
+        """
+        async with ctx.typing():
+            report = await self.schema_report(ctx.guild, ddl)
+        if not report:
+            return await ctx.send("The database schema matches tgschema")
+        for page in pagify(report):
+            await ctx.send(box(page, lang="sql" if ddl else ""))
+
+    @tgdb.command()
+    async def explain(self, ctx, save: bool = False):
+        """
+        EXPLAIN every TGDB statement, flagging full table scans, filesorts and temporary tables
+
+        Plans are compared with the saved snapshot and any regressions called out, pass true to save these plans
+        as the new snapshot. The first run saves one automatically
+        """
+        async with ctx.typing():
+            plans = await self.explain_statements(ctx)
+            stored = await self.stored_plans(ctx.guild)
+            if save or not stored:
+                await self.save_plans(ctx.guild, plans)
+        for page in pagify(format_plans(plans, stored)):
+            await ctx.send(box(page))
+        if save or not stored:
+            await ctx.send(
+                f"Saved {len(plans)} plans as the snapshot to compare against"
+            )
+
+    @tgdb.command()
+    async def snapshots(self, ctx, refresh: bool = False):
+        """
+        Load the in memory snapshots of the small tables and show their size and age, pass true to recheck them now
+        """
+        lines = []
+        async with ctx.typing():
+            for table in SNAPSHOT_TABLES:
+                snapshot = await self.table_snapshot(ctx, table, refresh)
+                stats = snapshot.stats()
+                lines.append(
+                    f"{table}: {stats['rows']} rows, version {stats['version']}, "
+                    f"loaded {stats['age_seconds']:.0f}s ago"
+                )
+        await ctx.send(box("\n".join(lines)))
+
     @tgdb.command()
     async def reconnect(self, ctx):
         """
@@ -94,6 +494,7 @@ class TGDB(BaseCog):
         """
         try:
             await self.config.guild(ctx.guild).mysql_host.set(db_host)
+            self.invalidate_settings(ctx.guild)
             await ctx.send(f"Database host set to: `{db_host}`")
         except (ValueError, KeyError, AttributeError):
             await ctx.send(
@@ -111,6 +512,7 @@ class TGDB(BaseCog):
                 1024 <= db_port <= 65535
             ):  # We don't want to allow reserved ports to be set
                 await self.config.guild(ctx.guild).mysql_port.set(db_port)
+                self.invalidate_settings(ctx.guild)
                 await ctx.send(f"Database port set to: `{db_port}`")
             else:
                 await ctx.send(f"{db_port} is not a valid port!")
@@ -129,6 +531,7 @@ class TGDB(BaseCog):
         """
         try:
             await self.config.guild(ctx.guild).mysql_user.set(user)
+            self.invalidate_settings(ctx.guild)
             await ctx.send(f"User set to: `{user}`")
         except (ValueError, KeyError, AttributeError):
             await ctx.send(
@@ -145,6 +548,7 @@ class TGDB(BaseCog):
         """
         try:
             await self.config.guild(ctx.guild).mysql_password.set(passwd)
+            self.invalidate_settings(ctx.guild)
             await ctx.send("Your password has been set.")
             try:
                 await ctx.message.delete()
@@ -165,6 +569,7 @@ class TGDB(BaseCog):
         """
         try:
             await self.config.guild(ctx.guild).mysql_db.set(db)
+            self.invalidate_settings(ctx.guild)
             await ctx.send(f"Database set to: `{db}`")
         except (ValueError, KeyError, AttributeError):
             await ctx.send("There was a problem setting your notes database.")
@@ -180,14 +585,87 @@ class TGDB(BaseCog):
         try:
             if prefix is None:
                 await self.config.guild(ctx.guild).mysql_prefix.set("")
+                self.invalidate_settings(ctx.guild)
                 await ctx.send(f"Database prefix removed!")
             else:
                 await self.config.guild(ctx.guild).mysql_prefix.set(prefix)
+                self.invalidate_settings(ctx.guild)
                 await ctx.send(f"Database prefix set to: `{prefix}`")
 
         except (ValueError, KeyError, AttributeError):
             await ctx.send("There was a problem setting your database prefix")
 
+    @tgdb_config.command()
+    @checks.is_owner()
+    async def warmup(self, ctx, enabled: bool):
+        """
+        Sets whether the connection pool is opened and health checked when the cog loads, defaults to on
+        """
+        await self.config.guild(ctx.guild).warm_up_on_load.set(enabled)
+        self.invalidate_settings(ctx.guild)
+        await ctx.send(f"Warm up on load set to: `{enabled}`")
+
+    @tgdb_config.command()
+    @checks.is_owner()
+    async def schemacheck(self, ctx, enabled: bool):
+        """
+        Sets whether the database schema is checked against tgschema when the cog loads, defaults to off
+        """
+        await self.config.guild(ctx.guild).check_schema_on_load.set(enabled)
+        self.invalidate_settings(ctx.guild)
+        await ctx.send(f"Schema check on load set to: `{enabled}`")
+
+    @tgdb_config.command()
+    @checks.is_owner()
+    async def pool(self, ctx, minsize: int, maxsize: int):
+        """
+        Sets the minimum and maximum number of connections kept in the pool, defaults to 1 and 10
+        """
+        if not 0 <= minsize <= maxsize or maxsize < 1:
+            return await ctx.send(
+                "The minimum pool size must be between 0 and the maximum, and the maximum at least 1"
+            )
+        await self.config.guild(ctx.guild).pool_minsize.set(minsize)
+        await self.config.guild(ctx.guild).pool_maxsize.set(maxsize)
+        self.invalidate_settings(ctx.guild)
+        await ctx.send(f"Pool size set to: `{minsize}-{maxsize}`")
+
+    @tgdb_config.command()
+    @checks.is_owner()
+    async def recycle(self, ctx, seconds: int):
+        """
+        Sets how many seconds a pooled connection is kept before it is reopened, defaults to 300
+        """
+        if seconds < 1:
+            return await ctx.send(f"{seconds} is not a valid recycle time!")
+        await self.config.guild(ctx.guild).pool_recycle.set(seconds)
+        self.invalidate_settings(ctx.guild)
+        await ctx.send(f"Connection recycle time set to: `{seconds}s`")
+
+    @tgdb_config.command()
+    @checks.is_owner()
+    async def acquire_timeout(self, ctx, seconds: float):
+        """
+        Sets how long a query waits for a free pooled connection before giving up, defaults to 5 seconds
+        """
+        if seconds <= 0:
+            return await ctx.send(f"{seconds} is not a valid timeout!")
+        await self.config.guild(ctx.guild).acquire_timeout.set(seconds)
+        self.invalidate_settings(ctx.guild)
+        await ctx.send(f"Acquire timeout set to: `{seconds}s`")
+
+    @tgdb_config.command()
+    @checks.is_owner()
+    async def query_timeout(self, ctx, seconds: float):
+        """
+        Sets how long a single query may run before it is abandoned, defaults to 10 seconds
+        """
+        if seconds <= 0:
+            return await ctx.send(f"{seconds} is not a valid timeout!")
+        await self.config.guild(ctx.guild).query_timeout.set(seconds)
+        self.invalidate_settings(ctx.guild)
+        await ctx.send(f"Query timeout set to: `{seconds}s`")
+
     @checks.mod_or_permissions(administrator=True)
     @tgdb_config.command()
     async def current(self, ctx):
@@ -213,10 +691,30 @@ class TGDB(BaseCog):
         """
         Given a one time token, and a discord user snowflake, insert the snowflake for the matching record in the discord links table
         """
-        prefix = await self.config.guild(ctx.guild).mysql_prefix()
-        query = f"UPDATE {prefix}discord_links SET discord_id = %s, valid = TRUE WHERE one_time_token = %s AND timestamp >= Now() - INTERVAL 4 HOUR AND discord_id IS NULL"
         parameters = [user_discord_snowflake, one_time_token]
-        query = await self.query_database(ctx, query, parameters)
+        query = await self.run_statement(ctx, "update_discord_link", parameters)
+        # We don't know which ckey the token belonged to, so every cached ckey lookup could now be stale
+        await self.invalidate_links(
+            ctx.guild, discord_id=user_discord_snowflake, all_ckeys=True
+        )
+
+    async def link_discord_account(
+        self, ctx, ckey: str, one_time_token: str, user_discord_snowflake: str
+    ):
+        """
+        Invalidate every existing link for the ckey and the discord user, then link them using the one time token
+
+        This all happens in one transaction, so a failure part way leaves the old links alone
+        """
+        async with self.transaction(ctx) as tx:
+            tx.defer("clear_all_valid_discord_links_for_ckey", [ckey])
+            tx.defer(
+                "clear_all_valid_discord_links_for_discord_id", [user_discord_snowflake]
+            )
+            tx.defer("update_discord_link", [user_discord_snowflake, one_time_token])
+        await self.invalidate_links(
+            ctx.guild, ckey=ckey, discord_id=user_discord_snowflake
+        )
 
     async def lookup_ckey_by_token(self, ctx, one_time_token: str):
         """
@@ -224,10 +722,8 @@ class TGDB(BaseCog):
         checks that the timestamp of the one time token has not exceeded 4 hours (hence expired) or there is no discord_id associated
         to that one time key already (it has been used), or it is has not been set to invalid
         """
-        prefix = await self.config.guild(ctx.guild).mysql_prefix()
-        query = f"SELECT ckey FROM {prefix}discord_links WHERE one_time_token = %s AND timestamp >= Now() - INTERVAL 4 HOUR AND discord_id IS NULL ORDER BY timestamp DESC LIMIT 1"
         parameters = [one_time_token]
-        results = await self.query_database(ctx, query, parameters)
+        results = await self.run_statement(ctx, "lookup_ckey_by_token", parameters)
         if len(results):
             return results[0]["ckey"]
 
@@ -235,158 +731,771 @@ class TGDB(BaseCog):
         """
         Given a valid discord id, return the latest record linked to that user
         """
-        prefix = await self.config.guild(ctx.guild).mysql_prefix()
-        query = f"SELECT * FROM {prefix}discord_links WHERE discord_id = %s AND ckey IS NOT NULL ORDER BY timestamp DESC LIMIT 1"
-        parameters = [discord_id]
-        results = await self.query_database(ctx, query, parameters)
-        if len(results):
-            return DiscordLink.from_db_record(results[0])
 
-        return None
+        async def load():
+            parameters = [discord_id]
+            results = await self.run_statement(
+                ctx, "discord_link_for_discord_id", parameters, as_tuples=True
+            )
+            if len(results):
+                return DiscordLink.from_db_row(results[0])
+
+            return None
+
+        key = await self.link_cache_key(ctx.guild, "discord_id", int(discord_id))
+        return await self.link_cache.get_or_load(key, load)
 
     async def discord_link_for_ckey(self, ctx, ckey):
         """
         Given a valid ckey, return the latest record linked to that user
         """
-        prefix = await self.config.guild(ctx.guild).mysql_prefix()
-        query = f"SELECT * FROM {prefix}discord_links WHERE ckey = %s AND discord_id IS NOT NULL ORDER BY timestamp DESC LIMIT 1"
-        parameters = [ckey]
-        results = await self.query_database(ctx, query, parameters)
-        if len(results):
-            return DiscordLink.from_db_record(results[0])
 
-        return None
+        async def load():
+            parameters = [ckey]
+            results = await self.run_statement(
+                ctx, "discord_link_for_ckey", parameters, as_tuples=True
+            )
+            if len(results):
+                return DiscordLink.from_db_row(results[0])
+
+            return None
+
+        key = await self.link_cache_key(ctx.guild, "ckey", ckey)
+        return await self.link_cache.get_or_load(key, load)
 
     async def clear_all_valid_discord_links_for_ckey(self, ctx, ckey):
         """
         Set the valid field to false for all links for the given ckey
         """
-        prefix = await self.config.guild(ctx.guild).mysql_prefix()
-        query = f"UPDATE {prefix}discord_links SET valid = FALSE WHERE ckey = %s AND valid = TRUE"
         parameters = [ckey]
-        results = await self.query_database(ctx, query, parameters)
+        results = await self.run_statement(
+            ctx, "clear_all_valid_discord_links_for_ckey", parameters
+        )
+        await self.invalidate_links(ctx.guild, ckey=ckey)
 
     async def clear_all_valid_discord_links_for_discord_id(self, ctx, discord_id):
         """
         Set the valid field to false for all links for the given discord id
         """
-        prefix = await self.config.guild(ctx.guild).mysql_prefix()
-        query = f"UPDATE {prefix}discord_links SET valid = FALSE WHERE discord_id = %s AND valid = TRUE"
         parameters = [discord_id]
-        results = await self.query_database(ctx, query, parameters)
+        results = await self.run_statement(
+            ctx, "clear_all_valid_discord_links_for_discord_id", parameters
+        )
+        await self.invalidate_links(ctx.guild, discord_id=discord_id)
+
+    async def database_scope(self, guild):
+        """
+        Which database and table prefix this guild talks to, cache keys use it so guilds sharing a database share entries
+        """
+        settings = await self.settings_for_guild(guild)
+        return (
+            settings.mysql_host,
+            settings.mysql_port,
+            settings.mysql_db,
+            settings.mysql_prefix,
+        )
+
+    async def link_cache_key(self, guild, kind: str, value):
+        """
+        Build a link cache key, scoped to the database rather than the guild
+        """
+        return (await self.database_scope(guild), kind, value)
+
+    async def table_snapshot(self, ctx, table: str, refresh: bool = False):
+        """
+        The whole of a small, rarely changing tgschema table (admin, admin_ranks, achievement_metadata...) held in
+        memory as records, see TableSnapshot for the lookups
+
+        A snapshot is trusted for SNAPSHOT_TTL seconds, after that the table's checksum is checked and the rows are
+        only read again if it changed. refresh forces the check now
+        """
+        key = (await self.database_scope(ctx.guild), table)
+        if refresh:
+            self.snapshot_cache.invalidate(key)
+
+        async def load():
+            previous = self._snapshots.get(key)
+            version = await self.table_version(ctx, table)
+            if previous is not None and version is not None:
+                if version == previous.version:
+                    return previous
+            name = f"snapshot_{table}"
+            if name not in self.queries:
+                self.queries.register(name, lambda t: select(t[table]))
+            rows = await self.run_query(ctx, name, record=records.for_table(table))
+            key_columns = [
+                column.name
+                for column in tgschema.metadata.tables[table].primary_key.columns
+            ]
+            snapshot = TableSnapshot(table, rows, key_columns, version)
+            self._snapshots[key] = snapshot
+            log.info(f"Loaded a snapshot of {table}, {len(rows)} rows")
+            return snapshot
+
+        return await self.snapshot_cache.get_or_load(key, load)
+
+    async def table_version(self, ctx, table: str):
+        """
+        Something that changes whenever the table does, its CHECKSUM TABLE
+        """
+        settings = await self.settings_for_guild(ctx.guild)
+        name = f"{settings.mysql_prefix}{table}"
+        rows = await self.query_database(
+            ctx, f"CHECKSUM TABLE `{name}`", None, name="checksum_table", as_tuples=True
+        )
+        return rows[0][1] if rows else None
+
+    async def invalidate_links(
+        self, guild, ckey: str = None, discord_id=None, all_ckeys: bool = False
+    ):
+        """
+        Drop cached links that a write touching this ckey and/or discord id could have changed
+        """
+        database = (await self.link_cache_key(guild, None, None))[0]
+        if discord_id is not None:
+            discord_id = int(discord_id)
+
+        def stale(key, link):
+            if key[0] != database:
+                return False
+            if key[1] == "ckey" and (all_ckeys or key[2] == ckey):
+                return True
+            if (
+                key[1] == "discord_id"
+                and discord_id is not None
+                and key[2] == discord_id
+            ):
+                return True
+            # Entries under the other key that point at the same link
+            if link is not None:
+                return link.ckey == ckey or (
+                    discord_id is not None and link.discord_id == discord_id
+                )
+            return False
+
+        self.link_cache.invalidate_where(stale)
 
     async def all_discord_links_for_ckey(self, ctx, ckey):
         """
         Given a valid ckey, return a list of all the valid records in the discord_links table for this user as discord link records
         ordered by timestamp descending
         """
-        prefix = await self.config.guild(ctx.guild).mysql_prefix()
-        query = f"SELECT * FROM {prefix}discord_links WHERE ckey = %s AND discord_id IS NOT NULL ORDER BY TIMESTAMP desc"
         parameters = [ckey]
-        discord_links = list()
-        results = await self.query_database(ctx, query, parameters)
+        results = await self.run_statement(
+            ctx, "all_discord_links_for_ckey", parameters, as_tuples=True
+        )
+        return [DiscordLink.from_db_row(result) for result in results]
+
+    async def bulk_query(self, ctx, name: str, keys, as_tuples=False):
+        """
+        Run a registered IN %s statement over a collection of keys, splitting it into chunks of BULK_CHUNK_SIZE
+        so a big collection doesn't blow past the server's packet limit, and return all the rows
+        """
+        rows = None
+        for chunk in chunked(set(keys), BULK_CHUNK_SIZE):
+            results = await self.run_statement(
+                ctx, name, [tuple(chunk)], as_tuples=as_tuples
+            )
+            if rows is None:
+                rows = results
+            else:
+                rows.extend(results)
+        if rows is None:
+            return Rows((), []) if as_tuples else []
+        return rows
+
+    async def discord_links_for_discord_ids(self, ctx, discord_ids):
+        """
+        Given a collection of discord ids, return a dict of discord id to the latest record linked to that user
+
+        Users with no linked record are left out of the dict
+        """
+        discord_links = {}
+        results = await self.bulk_query(
+            ctx, "discord_links_for_discord_ids", discord_ids, as_tuples=True
+        )
+        discord_id = DiscordLink._fields.index("discord_id")
+        # Newest first, so the first record we see for each user is the latest one
         for result in results:
-            discord_links.append(DiscordLink.from_db_record(result))
+            if result[discord_id] not in discord_links:
+                discord_links[result[discord_id]] = DiscordLink.from_db_row(result)
         return discord_links
 
+    async def discord_links_for_ckeys(self, ctx, ckeys):
+        """
+        Given a collection of ckeys, return a dict of ckey to the latest record linked to that ckey
+
+        Ckeys with no linked record are left out of the dict
+        """
+        discord_links = {}
+        for ckey, links in (await self.all_discord_links_for_ckeys(ctx, ckeys)).items():
+            discord_links[ckey] = links[0]
+        return discord_links
+
+    async def all_discord_links_for_ckeys(self, ctx, ckeys):
+        """
+        Given a collection of ckeys, return a dict of ckey to a list of all its records in the discord_links table,
+        ordered by timestamp descending
+
+        Ckeys with no linked record are left out of the dict
+        """
+        discord_links = {}
+        results = await self.bulk_query(
+            ctx, "discord_links_for_ckeys", ckeys, as_tuples=True
+        )
+        for result in results:
+            link = DiscordLink.from_db_row(result)
+            discord_links.setdefault(link.ckey, []).append(link)
+        return discord_links
+
+    async def living_minutes_for_ckeys(self, ctx, ckeys):
+        """
+        Given a collection of ckeys, return a dict of ckey to living minutes, ckeys with no living time are left out
+        """
+        # Rows are (ckey, minutes) pairs already
+        return dict(
+            await self.bulk_query(
+                ctx, "living_minutes_for_ckeys", ckeys, as_tuples=True
+            )
+        )
+
     async def get_player_by_ckey(self, ctx, ckey: str):
         """
         Given a ckey, look up the player and return some useful information we use to calculate if we can verify this user or not, (do they have
         an appropriate amount of living time)
+
+        The player row and their living/ghost minutes come back from a single query as a PlayerProfile, or None if no player was found
         """
-        prefix = await self.config.guild(ctx.guild).mysql_prefix()
-        query = f"SELECT ckey, firstseen, lastseen, computerid, ip, accountjoindate FROM {prefix}player WHERE ckey=%s"
-        query = await self.query_database(ctx, query, [ckey])
-        results = {}
-        try:
-            query = query[
-                0
-            ]  # Checks to see if a player was found, if the list is empty nothing was found so we return the empty dict.
-        except IndexError:
-            return None
+        results = await self.run_statement(ctx, "get_player_by_ckey", [ckey])
+        if len(results):
+            return PlayerProfile.from_db_record(results[0])
 
-        results["ip"] = ipaddress.IPv4Address(
-            query["ip"]
-        )  # IP's are stored as a 32 bit integer, converting it for readability
-        results["cid"] = query["computerid"]
-        results["ckey"] = query["ckey"]
-        results["first"] = query["firstseen"]
-        results["last"] = query["lastseen"]
-        results["join"] = query["accountjoindate"]
-
-        # Obtain role time statistics
-        query = f"SELECT job, minutes FROM {prefix}role_time WHERE ckey=%s AND (job='Ghost' OR job='Living')"
-        try:
-            query = await self.query_database(ctx, query, [ckey])
-        except aiomysql.Error:
-            query = None
-        if query:
-            for job in query:
-                if job["job"] == "Living":
-                    results["living_time"] = job["minutes"]
-                else:
-                    results["ghost_time"] = job["minutes"]
+        return None
+
+    async def player_by_token(self, ctx, one_time_token: str):
+        """
+        lookup_ckey_by_token and get_player_by_ckey together in a single query, returns (ckey, PlayerProfile)
+
+        Both are None if the token doesn't match an unused, unexpired link, the profile alone is None if the ckey
+        has no player row
+        """
+        results = await self.run_statement(ctx, "player_by_token", [one_time_token])
+        if not len(results):
+            return None, None
+        row = results[0]
+        if row["ckey"] is None:
+            return row["link_ckey"], None
+        return row["link_ckey"], PlayerProfile.from_db_record(row)
 
-            if "living_time" not in results.keys():
-                results["living_time"] = 0
-            if "ghost_time" not in results.keys():
-                results["ghost_time"] = 0
+    def get_stats(self):
+        """
+        Everything TGDB measures about itself as a plain dict, for other cogs to read
+        """
+        stats = self.metrics.snapshot()
+        stats["pools"] = self.pools.gauges()
+        stats["breakers"] = [
+            {
+                "pool": f"{key.user}@{key.host}:{key.port}/{key.db}",
+                "state": breaker.state,
+                "failures": breaker.failures,
+            }
+            for key, breaker in self.breakers.items()
+        ]
+        stats["link_cache"] = self.link_cache.stats()
+        stats["statements"] = self.statements.stats()
+        stats["query_builder"] = self.queries.stats()
+        stats["snapshots"] = [
+            dict(snapshot.stats(), database=f"{key[0][0]}:{key[0][1]}/{key[0][2]}")
+            for key, snapshot in self._snapshots.items()
+        ]
+        return stats
 
-        else:
-            results["living_time"] = 0
-            results["ghost_time"] = 0
+    async def table_census(self, ctx, approximate: bool = False, tables=None):
+        """
+        Row counts for the tgschema tables (all of them unless names are given) and any drift between the models
+        and the live schema
 
-            results["total_time"] = results["living_time"] + results["ghost_time"]
+        Exact counts of the log tables can hold a connection for minutes, so the census opens a short lived pool of
+        its own (at most half the guild's pool size) rather than taking connections verifies are waiting on
+        """
+        key = await self.pool_key_for_guild(ctx.guild)
+        self.breaker_for(key).check()
+        settings = await self.settings_for_guild(ctx.guild)
+        connections = max(1, key.maxsize // 2)
+        started = time.perf_counter()
+        async with self.pools.dedicated(key, connections) as pool:
+            counts = await count_tables(
+                pool,
+                settings.mysql_prefix,
+                tables,
+                concurrency=connections,
+                approximate=approximate,
+            )
+            drift = await validate_models(pool, settings.mysql_prefix, tables)
+        self.metrics.record("census", time.perf_counter() - started)
+        return counts, drift
+
+    async def schema_report(self, guild, ddl: bool = False):
+        """
+        Plain text report of where the live schema differs from tgschema, missing tables and columns, then missing
+        indexes with the ones TGDB's own queries need called out. Empty if everything matches
+        """
+        key = await self.pool_key_for_guild(guild)
+        self.breaker_for(key).check()
+        pool = await self.pools.get(key)
+        prefix = (await self.settings_for_guild(guild)).mysql_prefix
+        drift = await validate_models(pool, prefix)
+        hot = await missing_indexes(pool, HOT_INDEXES, prefix)
+        declared = [
+            spec
+            for spec in await missing_indexes(pool, declared_indexes(), prefix)
+            if not any(spec.table == h.table and spec.columns == h.columns for h in hot)
+        ]
+        sections = [
+            format_census([], drift),
+            format_indexes(hot, prefix, ddl, label="used by TGDB lookups"),
+            format_indexes(declared, prefix, ddl),
+        ]
+        return "\n".join(section for section in sections if section)
+
+    async def explain_query(self, ctx, query: str, parameters: list, name="adhoc"):
+        """
+        Run EXPLAIN FORMAT=JSON on a query and return the analysed PlanSnapshot, nothing is executed
+        """
+        key = await self.pool_key_for_guild(ctx.guild)
+        self.breaker_for(key).check()
+        pool = await self.pools.get(key)
+        settings = await self.settings_for_guild(ctx.guild)
+        async with acquire(pool, settings.acquire_timeout) as conn:
+            async with conn.cursor() as cur:
+                await execute(
+                    conn,
+                    cur,
+                    f"EXPLAIN FORMAT=JSON {query}",
+                    parameters,
+                    settings.query_timeout,
+                )
+                (raw,) = await cur.fetchone()
+        return snapshot(name, raw)
+
+    async def explain_statements(self, ctx, names=None):
+        """
+        Plans for the registered statements (all of them unless names are given) using each one's sample parameters
+        """
+        settings = await self.settings_for_guild(ctx.guild)
+        plans = []
+        for statement in self.statements:
+            if statement.sample is None or (names and statement.name not in names):
+                continue
+            query = self.statements.render(statement.name, settings.mysql_prefix)
+            plans.append(
+                await self.explain_query(ctx, query, statement.sample, statement.name)
+            )
+        return plans
+
+    async def plan_store_key(self, guild):
+        settings = await self.settings_for_guild(guild)
+        return f"{settings.mysql_host}:{settings.mysql_port}/{settings.mysql_db}/{settings.mysql_prefix}"
+
+    async def stored_plans(self, guild):
+        """
+        The saved plan snapshot for this guild's database, {statement name: stored plan}
+        """
+        key = await self.plan_store_key(guild)
+        return (await self.config.plan_snapshots()).get(key, {})
+
+    async def save_plans(self, guild, plans):
+        key = await self.plan_store_key(guild)
+        async with self.config.plan_snapshots() as snapshots:
+            stored = snapshots.setdefault(key, {})
+            for plan in plans:
+                stored[plan.name] = to_stored(plan)
+
+    async def settings_for_guild(self, guild):
+        """
+        Return the cached settings snapshot for this guild, loading it from Config in one read if we don't have one
+        """
+        settings = self._settings.get(guild.id)
+        if settings is None:
+            stored = await self.config.guild(guild).all()
+            settings = GuildSettings._make(
+                stored[field] for field in GuildSettings._fields
+            )
+            self._settings[guild.id] = settings
+        return settings
+
+    def invalidate_settings(self, guild):
+        """
+        Drop the cached settings for this guild, call this whenever one of its config values is changed
+        """
+        self._settings.pop(guild.id, None)
+
+    async def pool_key_for_guild(self, guild):
+        """
+        Resolve the connection parameters this guild is configured with into a pool registry key
+        """
+        settings = await self.settings_for_guild(guild)
+        db_host = await self.resolver.resolve(settings.mysql_host)
+        return PoolKey(
+            db_host,
+            settings.mysql_port,
+            settings.mysql_db,
+            settings.mysql_user,
+            settings.mysql_password,
+            settings.pool_minsize,
+            settings.pool_maxsize,
+            settings.pool_recycle,
+        )
 
-        return results
+    async def pool_for_guild(self, guild):
+        """
+        Return the pool serving this guild, guilds pointed at the same database share one
+        """
+        return await self.pools.get(await self.pool_key_for_guild(guild))
 
     async def reconnect_to_db_with_guild_context_config(self, ctx):
-        db = await self.config.guild(ctx.guild).mysql_db()
-        db_host = socket.gethostbyname(await self.config.guild(ctx.guild).mysql_host())
-        db_port = await self.config.guild(ctx.guild).mysql_port()
-        db_user = await self.config.guild(ctx.guild).mysql_user()
-        db_pass = await self.config.guild(ctx.guild).mysql_password()
-        await self.reconnect_to_db(db, db_host, db_port, db_user, db_pass)
+        key = await self.pool_key_for_guild(ctx.guild)
+        await self.pools.replace(key)
 
     async def reconnect_to_db(self, db, db_host, db_port, db_user, db_pass):
         """
-        Open a connection to the database and save the pool in use
-        """
-        # Database options loaded from the config
-        if self.pool:
-            self.pool.close()
-            await self.pool.wait_closed()
-
-        # Establish a connection with the database and pull the relevant data, recycle them every 300 seconds
-        self.pool = await aiomysql.create_pool(
-            host=db_host,
-            port=db_port,
-            db=db,
-            user=db_user,
-            password=db_pass,
-            connect_timeout=5,
-            pool_recycle=300,
+        Open a fresh connection pool for these connection details, replacing any existing one
+        """
+        return await self.pools.replace(PoolKey(db_host, db_port, db, db_user, db_pass))
+
+    def breaker_for(self, key: PoolKey):
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(
+                failure_threshold=5, reset_timeout=30
+            )
+        return breaker
+
+    def record_failure(self, key: PoolKey, name: str, error: BaseException):
+        """
+        Count a failed query, if the connection was at fault move the breaker towards open. Once it opens
+        a fresh pool gets built in the background, a one off broken connection is just dropped by the pool
+        """
+        self.metrics.record_error(name, error)
+        if is_connection_error(error):
+            breaker = self.breaker_for(key)
+            breaker.record_failure()
+            if breaker.is_open:
+                self.schedule_pool_recovery(key)
+
+    def schedule_pool_recovery(self, key: PoolKey):
+        if key in self._recoveries:
+            return
+        self._recoveries[key] = self.bot.loop.create_task(self.recover_pool(key))
+
+    async def recover_pool(self, key: PoolKey):
+        """
+        Keep rebuilding the pool for this key, backing off between attempts, until it comes up healthy
+        """
+        attempt = 0
+        try:
+            while True:
+                try:
+                    await self.pools.replace(key)
+                    await self.pools.warm(key)
+                    self.breaker_for(key).record_success()
+                    log.info(
+                        f"Recreated the database pool for {key.host}:{key.port}/{key.db}"
+                    )
+                    return
+                except Exception as e:
+                    attempt += 1
+                    delay = min(60, 2**attempt)
+                    log.warning(
+                        f"Recreating the database pool for {key.host}:{key.port}/{key.db} failed ({e}), retrying in {delay}s"
+                    )
+                    await asyncio.sleep(delay)
+        finally:
+            del self._recoveries[key]
+
+    async def guarded(self, ctx, name: str, operation, attempts: int = 1):
+        """
+        Run operation(pool) against the guild's pool behind its circuit breaker, retrying connection failures
+        up to attempts times in total with jittered backoff. Only pass attempts > 1 for idempotent operations
+        """
+        key = await self.pool_key_for_guild(ctx.guild)
+        breaker = self.breaker_for(key)
+        for attempt in range(1, attempts + 1):
+            breaker.check()
+            try:
+                result = await operation(await self.pools.get(key))
+            except Exception as e:
+                self.record_failure(key, name, e)
+                if not is_connection_error(e):
+                    raise
+                if attempt >= attempts or breaker.is_open:
+                    raise TGDatabaseUnavailableError(
+                        "The database is currently unreachable, please try again in a little while"
+                    ) from e
+                log.info(f"Retrying {name} after a connection failure ({e})")
+                await asyncio.sleep(backoff_delay(attempt))
+            else:
+                breaker.record_success()
+                return result
+
+    async def render_statement(self, guild, name: str):
+        """
+        Return the SQL for a registered statement, rendered with this guild's table prefix
+        """
+        settings = await self.settings_for_guild(guild)
+        return self.statements.render(name, settings.mysql_prefix)
+
+    async def run_statement(
+        self, ctx, name: str, parameters: list, as_tuples: bool = False
+    ):
+        """
+        Run one of the registered statements against the database for the guild in this context
+        """
+        settings = await self.settings_for_guild(ctx.guild)
+        timeout = self.statements[name].deadline(settings.query_timeout)
+        query = self.statements.render(name, settings.mysql_prefix, timeout)
+        return await self.query_database(
+            ctx, query, parameters, name=name, as_tuples=as_tuples, timeout=timeout
+        )
+
+    async def run_query(
+        self,
+        ctx,
+        name: str,
+        values: dict = None,
+        as_tuples: bool = False,
+        record=None,
+    ):
+        """
+        Run one of the Core queries registered on self.queries against the database for the guild in this context,
+        values fill in the query's bindparams by name
+
+        Pass one of the tgcommon.models.records classes as record to get the rows back as records,
+        the query has to select every column the record has
+        """
+        settings = await self.settings_for_guild(ctx.guild)
+        timeout = self.queries[name].deadline(settings.query_timeout)
+        compiled = self.queries.compile(name, settings.mysql_prefix, timeout)
+        rows = await self.query_database(
+            ctx,
+            compiled.sql,
+            compiled.parameters(values),
+            name=name,
+            as_tuples=as_tuples or record is not None,
+            timeout=timeout,
         )
+        if record is not None:
+            return record.from_rows(rows)
+        return rows
 
-    async def query_database(self, ctx, query: str, parameters: list):
+    @asynccontextmanager
+    async def transaction(self, ctx):
         """
-        Use our active pool to pass in the given query
+        Open a transaction on one connection from the guild's pool, committed when the block exits cleanly
+        and rolled back if it raises
         """
-        if not self.pool:
-            await self.reconnect_to_db_with_guild_context_config(ctx)
-            raise TGUnrecoverableError(
-                "The database was not connected,  a reconnect was attempted"
+        key = await self.pool_key_for_guild(ctx.guild)
+        self.breaker_for(key).check()
+        pool = await self.pools.get(key)
+        settings = await self.settings_for_guild(ctx.guild)
+        started = time.perf_counter()
+        async with acquire(pool, settings.acquire_timeout) as conn:
+            acquired = time.perf_counter()
+            tx = Transaction(
+                conn, self.statements, settings.mysql_prefix, settings.query_timeout
+            )
+            try:
+                yield tx
+                await tx.commit()
+            except BaseException as e:
+                self.record_failure(key, "transaction", e)
+                await tx.rollback()
+                raise
+            self.metrics.observe(
+                "transaction", acquired - started, time.perf_counter() - acquired
             )
 
-        try:
-            log.debug(f"Executing query {query}, with parameters {parameters}")
-            async with self.pool.acquire() as conn:
-                async with conn.cursor(aiomysql.DictCursor) as cur:
-                    await cur.execute(query, parameters)
-                    rows = cur.fetchall()
-                    # WRITE TO STORAGE LOL
-                    await conn.commit()
-                    return rows.result()
-
-        except:
-            raise
+    def stream_statement(
+        self, ctx, name: str, parameters: list, batch_size: int = None, as_dicts=True
+    ):
+        """
+        Stream one of the registered statements, see stream_query
+        """
+        return self.stream_query(ctx, None, parameters, batch_size, as_dicts, name=name)
+
+    @asynccontextmanager
+    async def stream_query(
+        self,
+        ctx,
+        query: str,
+        parameters: list,
+        batch_size: int = None,
+        as_dicts=True,
+        name: str = "adhoc",
+    ):
+        """
+        Run a read query on a server side cursor and hand back an async iterator over the results, so large
+        result sets (connection_log, role_time_log, ban...) never have to fit in memory at once
+
+            async with tgdb.stream_query(ctx, query, parameters, batch_size=500) as batches:
+                async for batch in batches:
+                    ...
+
+        With no batch_size the iterator yields one row at a time, otherwise lists of up to batch_size rows.
+        The connection stays checked out of the pool until the block exits, so keep the loop body quick,
+        the server will drop a connection whose client stops reading for longer than net_write_timeout
+        """
+        if query is None:
+            query = await self.render_statement(ctx.guild, name)
+        key = await self.pool_key_for_guild(ctx.guild)
+        self.breaker_for(key).check()
+        pool = await self.pools.get(key)
+        cursor_class = aiomysql.SSDictCursor if as_dicts else aiomysql.SSCursor
+        log.debug(f"Streaming query {query}, with parameters {parameters}")
+
+        settings = await self.settings_for_guild(ctx.guild)
+        started = time.perf_counter()
+        async with acquire(pool, settings.acquire_timeout) as conn:
+            acquired = time.perf_counter()
+            exhausted = False
+            try:
+                # Failures are only counted against the database for our own cursor calls, not the caller's loop
+                try:
+                    cur = await conn.cursor(cursor_class)
+                    # Only the execute is bounded, a server side cursor keeps the query running while rows are read
+                    await execute(conn, cur, query, parameters, settings.query_timeout)
+                except Exception as e:
+                    self.record_failure(key, name, e)
+                    raise
+                self.breaker_for(key).record_success()
+                executed = time.perf_counter()
+
+                async def rows():
+                    nonlocal exhausted
+                    try:
+                        while True:
+                            if batch_size:
+                                batch = await cur.fetchmany(batch_size)
+                                if not batch:
+                                    break
+                                yield batch
+                            else:
+                                row = await cur.fetchone()
+                                if row is None:
+                                    break
+                                yield row
+                    except Exception as e:
+                        self.record_failure(key, name, e)
+                        raise
+                    exhausted = True
+
+                yield rows()
+                self.metrics.observe(
+                    name,
+                    acquired - started,
+                    executed - acquired,
+                    time.perf_counter() - executed,
+                )
+            finally:
+                if exhausted:
+                    await cur.close()
+                else:
+                    # Draining the rest of an abandoned result set could take forever, throw the connection away instead
+                    conn.close()
+
+    async def query_database(
+        self,
+        ctx,
+        query: str,
+        parameters: list,
+        name: str = "adhoc",
+        as_tuples: bool = False,
+        timeout: float = None,
+    ):
+        """
+        Run the given query against the pool for the guild in this context
+
+        Reads return their rows, anything else returns the number of affected rows. The name is what the
+        query's timings are recorded under.
+
+        The query gets timeout seconds, the guild's query timeout if not given. SELECTs carry a MAX_EXECUTION_TIME
+        hint so MySQL stops them server side, and the client abandons (and closes) the connection shortly after
+        in case the server doesn't, MariaDB ignores the hint so there the client deadline is all there is.
+        Either way the caller gets a TGQueryTimeoutError
+        """
+        if is_read_query(query):
+            return await self.read_database(
+                ctx, query, parameters, name, as_tuples, timeout
+            )
+        return await self.write_database(ctx, query, parameters, name, timeout)
+
+    async def read_database(
+        self,
+        ctx,
+        query: str,
+        parameters: list,
+        name: str = "adhoc",
+        as_tuples: bool = False,
+        timeout: float = None,
+    ):
+        """
+        Run a read only query and return the rows, connections are in autocommit so there is no COMMIT round trip
+
+        Rows are dicts, or with as_tuples plain tuples in a Rows list that maps column names to positions.
+        A read that fails because the connection broke is retried on another connection
+        """
+        cursor_class = aiomysql.Cursor if as_tuples else aiomysql.DictCursor
+        settings = await self.settings_for_guild(ctx.guild)
+        timeout = timeout or settings.query_timeout
+        query = with_execution_hint(query, timeout)
+        log.debug(f"Executing query {query}, with parameters {parameters}")
+
+        async def read(pool):
+            started = time.perf_counter()
+            async with acquire(pool, settings.acquire_timeout) as conn:
+                acquired = time.perf_counter()
+                async with conn.cursor(cursor_class) as cur:
+                    await execute(conn, cur, query, parameters, timeout + CLIENT_GRACE)
+                    executed = time.perf_counter()
+                    rows = await cur.fetchall()
+                    if as_tuples:
+                        rows = Rows.from_cursor(cur, rows)
+            self.metrics.observe(
+                name,
+                acquired - started,
+                executed - acquired,
+                time.perf_counter() - executed,
+            )
+            return rows
+
+        return await self.guarded(ctx, name, read, attempts=READ_ATTEMPTS)
+
+    async def write_database(
+        self,
+        ctx,
+        query: str,
+        parameters: list,
+        name: str = "adhoc",
+        timeout: float = None,
+    ):
+        """
+        Run a single write statement, autocommit makes it durable as soon as it returns
+
+        Writes are never retried, we can't tell whether one that lost its connection was applied or not
+        """
+        settings = await self.settings_for_guild(ctx.guild)
+        timeout = timeout or settings.query_timeout
+        log.debug(f"Executing query {query}, with parameters {parameters}")
+
+        async def write(pool):
+            started = time.perf_counter()
+            async with acquire(pool, settings.acquire_timeout) as conn:
+                acquired = time.perf_counter()
+                async with conn.cursor() as cur:
+                    affected = await execute(conn, cur, query, parameters, timeout)
+            self.metrics.observe(
+                name, acquired - started, time.perf_counter() - acquired
+            )
+            return affected
+
+        return await self.guarded(ctx, name, write)
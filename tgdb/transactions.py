@@ -0,0 +1,73 @@
+# Standard Imports
+import logging
+
+import aiomysql
+
+from .pools import CLIENT_GRACE, execute
+
+log = logging.getLogger("red.oranges_tgdb.transactions")
+
+
+class Transaction:
+    """
+    A group of statements that commit or roll back together on one pooled connection
+
+    Statements passed to execute run straight away, statements passed to defer are held back and sent one after
+    another just before the COMMIT, so the transaction's locks are only held for the writes themselves.
+    They aren't stacked into one multi statement batch, pooled connections don't allow those
+    """
+
+    def __init__(self, conn, statements, prefix: str, timeout: float):
+        self.conn = conn
+        self.statements = statements
+        self.prefix = prefix
+        self.timeout = timeout
+        self.started = False
+        self._deferred = []
+
+    async def _begin(self):
+        if not self.started:
+            await self.conn.begin()
+            self.started = True
+
+    async def execute(self, name: str, parameters: list):
+        """
+        Run a registered statement inside the transaction now, returning its rows
+        """
+        await self._begin()
+        timeout = self.statements[name].deadline(self.timeout)
+        query = self.statements.render(name, self.prefix, timeout)
+        log.debug(
+            f"Executing query {query} in transaction, with parameters {parameters}"
+        )
+        async with self.conn.cursor(aiomysql.DictCursor) as cur:
+            await execute(self.conn, cur, query, parameters, timeout + CLIENT_GRACE)
+            return await cur.fetchall()
+
+    def defer(self, name: str, parameters: list):
+        """
+        Queue a registered statement to be sent with the other deferred ones just before the COMMIT
+        """
+        self._deferred.append(
+            (name, self.statements.render(name, self.prefix), parameters)
+        )
+
+    async def commit(self):
+        if self._deferred:
+            await self._begin()
+            deferred, self._deferred = self._deferred, []
+            async with self.conn.cursor() as cur:
+                for name, query, parameters in deferred:
+                    log.debug(
+                        f"Executing query {query} in transaction, with parameters {parameters}"
+                    )
+                    timeout = self.statements[name].deadline(self.timeout)
+                    await execute(self.conn, cur, query, parameters, timeout)
+        if self.started:
+            await self.conn.commit()
+
+    async def rollback(self):
+        self._deferred.clear()
+        # A connection closed by a client deadline can't take a ROLLBACK, the server drops the transaction with it
+        if self.started and not self.conn.closed:
+            await self.conn.rollback()
@@ -0,0 +1,181 @@
+# Standard Imports
+import asyncio
+import logging
+import time
+
+# Discord Imports
+import discord
+
+from tgcommon.util import chunked
+
+log = logging.getLogger("red.oranges_tgverify.reverify")
+
+
+class RateLimiter:
+    """
+    Token bucket, lets through burst calls at once and then rate calls per second
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def wait(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def back_off(self, seconds: float):
+        """
+        Discord told us to slow down, empty the bucket and push the next refill out
+        """
+        self.tokens = 0
+        self.updated = time.monotonic() + seconds
+
+
+class ReverifyJob:
+    """
+    Walks every member of a guild in id order and applies any verification roles they qualify for but don't have
+
+    Members are handled a page at a time, one bulk lookup for the page's discord links and one for the
+    linked ckeys' living minutes. After each page the id of the last member is saved, so a stopped or
+    interrupted job can carry on from there
+    """
+
+    def __init__(
+        self,
+        cog,
+        ctx,
+        role: discord.Role,
+        living_role: discord.Role,
+        min_living_minutes: int,
+        cursor: int = 0,
+        page_size: int = 200,
+    ):
+        self.cog = cog
+        self.ctx = ctx
+        self.guild = ctx.guild
+        self.role = role
+        self.living_role = living_role
+        self.min_living_minutes = min_living_minutes
+        self.cursor = cursor
+        self.page_size = page_size
+        self.limiter = RateLimiter(rate=1, burst=5)
+        self.total = 0
+        self.checked = 0
+        self.updated = 0
+        self.failed = 0
+        self.started = None
+        self.finished = False
+        self.stopped = False
+        self.task = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        self.started = time.monotonic()
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def stop(self):
+        if self.running:
+            self.task.cancel()
+
+    def progress(self):
+        elapsed = int(time.monotonic() - self.started) if self.started else 0
+        if self.finished:
+            state = "завершена"
+        elif self.stopped:
+            state = "остановлена"
+        else:
+            state = "выполняется"
+        return (
+            f"Повторная верификация {state}: проверено {self.checked}/{self.total} участников, "
+            f"обновлено {self.updated}, ошибок {self.failed}, прошло {elapsed}с"
+        )
+
+    async def run(self):
+        tgdb = self.cog.get_tgdb()
+        if not self.guild.chunked:
+            await self.guild.chunk()
+
+        members = sorted(
+            (m for m in self.guild.members if not m.bot and m.id > self.cursor),
+            key=lambda m: m.id,
+        )
+        self.total = len(members)
+        message = await self.ctx.send(self.progress())
+
+        try:
+            for page in chunked(members, self.page_size):
+                links = await tgdb.discord_links_for_discord_ids(
+                    self.ctx, [member.id for member in page]
+                )
+                links = {
+                    discord_id: link
+                    for discord_id, link in links.items()
+                    if link.validity
+                }
+                minutes = await tgdb.living_minutes_for_ckeys(
+                    self.ctx, [link.ckey for link in links.values()]
+                )
+
+                for member in page:
+                    link = links.get(member.id)
+                    if link:
+                        await self.apply_roles(member, minutes.get(link.ckey, 0))
+                    self.checked += 1
+
+                self.cursor = page[-1].id
+                await self.cog.config.guild(self.guild).reverify_cursor.set(self.cursor)
+                await message.edit(content=self.progress())
+
+            self.finished = True
+            await self.cog.config.guild(self.guild).reverify_cursor.set(0)
+        except asyncio.CancelledError:
+            self.stopped = True
+            log.info(
+                f"Повторная верификация {self.guild.name} остановлена на {self.cursor}"
+            )
+            raise
+        except Exception:
+            self.stopped = True
+            log.exception(
+                f"Ошибка повторной верификации {self.guild.name} на {self.cursor}"
+            )
+        finally:
+            try:
+                await message.edit(content=self.progress())
+            except discord.DiscordException:
+                pass
+
+    async def apply_roles(self, member: discord.Member, living_minutes: int):
+        wanted = [self.role]
+        if living_minutes >= self.min_living_minutes:
+            wanted.append(self.living_role)
+        missing = [role for role in wanted if role not in member.roles]
+        if not missing:
+            return
+
+        await self.limiter.wait()
+        try:
+            await member.add_roles(
+                *missing, reason="Пользователь прошел повторную верификацию"
+            )
+            self.updated += 1
+        except discord.HTTPException as e:
+            self.failed += 1
+            if e.status == 429:
+                self.limiter.back_off(5)
+            log.warning(f"Не удалось выдать роли верификации {member}: {e}")
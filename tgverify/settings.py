@@ -0,0 +1,49 @@
+from collections import namedtuple
+
+BaseResolvedSettings = namedtuple(
+    "ResolvedSettings",
+    "min_living_minutes, instructions_link, role, living_role, channel, greeting_template, disabled, bunker, "
+    "welcome_batching, welcome_batch_window, welcome_batch_size, welcome_batch_latency",
+)
+
+
+class ResolvedSettings(BaseResolvedSettings):
+    """
+    A guild's TGverify config read in one go, with the role and channel ids already looked up and the welcome
+    greeting (disabled or not, plus the bunker warning) already put together
+
+    role, living_role and channel are None if they aren't set or no longer exist
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_config(cls, guild, stored: dict):
+        if stored["disabled"]:
+            template = stored["disabledgreeting"]
+        else:
+            template = stored["welcomegreeting"]
+        if stored["bunkerwarning"] != "" and stored["bunker"]:
+            # The warning was never formatted, so its braces are escaped rather than treated as fields
+            warning = stored["bunkerwarning"].replace("{", "{{").replace("}", "}}")
+            template = template + " " + warning
+        return cls(
+            stored["min_living_minutes"],
+            stored["instructions_link"],
+            guild.get_role(stored["verified_role"]),
+            guild.get_role(stored["verified_living_role"]),
+            guild.get_channel(stored["welcomechannel"] or 0),
+            template,
+            stored["disabled"],
+            stored["bunker"],
+            stored["welcome_batching"],
+            stored["welcome_batch_window"],
+            stored["welcome_batch_size"],
+            stored["welcome_batch_latency"],
+        )
+
+    def greeting(self, member):
+        """
+        The welcome message for this member (or MemberGroup), the template gets the member and the guild as {0} and {1}
+        """
+        return self.greeting_template.format(member, member.guild)
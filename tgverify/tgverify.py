@@ -1,5 +1,7 @@
 # Standard Imports
+import asyncio
 import logging
+import time
 from typing import Union
 
 # Discord Imports
@@ -8,10 +10,19 @@ import discord
 # Redbot Imports
 from redbot.core import commands, checks, Config
 
-from tgcommon.errors import TGRecoverableError, TGUnrecoverableError
+from tgcommon.errors import (
+    TGRecoverableError,
+    TGUnrecoverableError,
+    TGPoolExhaustedError,
+)
 from tgcommon.util import normalise_to_ckey
 from typing import cast
 
+from .reverify import ReverifyJob
+from .settings import ResolvedSettings
+from .verifyqueue import VerifyQueue
+from .welcomes import MemberGroup, WelcomeBatcher
+
 __version__ = "1.1.0"
 __author__ = "oranges"
 
@@ -39,6 +50,11 @@ class TGverify(BaseCog):
             "bunkerwarning",
             "bunker",
             "welcomechannel",
+            "reverify_cursor",
+            "welcome_batching",
+            "welcome_batch_window",
+            "welcome_batch_size",
+            "welcome_batch_latency",
         ]
 
         default_guild = {
@@ -52,9 +68,26 @@ class TGverify(BaseCog):
             "bunker": False,
             "disabled": False,
             "welcomechannel": "",
+            "reverify_cursor": 0,
+            "welcome_batching": False,
+            "welcome_batch_window": 2.0,
+            "welcome_batch_size": 10,
+            "welcome_batch_latency": 10.0,
         }
 
         self.config.register_guild(**default_guild)
+        self._settings = {}
+        self.reverify_jobs = {}
+        self.verify_queues = {}
+        self.welcome_batchers = {}
+
+    def cog_unload(self):
+        for job in self.reverify_jobs.values():
+            job.stop()
+        for queue in self.verify_queues.values():
+            queue.close()
+        for batcher in self.welcome_batchers.values():
+            batcher.close()
 
     @commands.guild_only()
     @commands.group()
@@ -99,6 +132,7 @@ class TGverify(BaseCog):
         try:
             if min_living_minutes is None:
                 await self.config.guild(ctx.guild).min_living_minutes.set(0)
+                self.invalidate_settings(ctx.guild)
                 await ctx.send(
                     f"Минимальное количество прожитых минут, необходимое для верификации убрано!"
                 )
@@ -106,6 +140,7 @@ class TGverify(BaseCog):
                 await self.config.guild(ctx.guild).min_living_minutes.set(
                     min_living_minutes
                 )
+                self.invalidate_settings(ctx.guild)
                 await ctx.send(
                     f"Минимальное количество минут жизни, необходимое для верификации, установлено на: `{min_living_minutes}`"
                 )
@@ -122,6 +157,7 @@ class TGverify(BaseCog):
         """
         try:
             await self.config.guild(ctx.guild).instructions_link.set(instruction_link)
+            self.invalidate_settings(ctx.guild)
             await ctx.send(f"Ссылка на инструкцию установлена на: `{instruction_link}`")
 
         except (ValueError, KeyError, AttributeError):
@@ -145,6 +181,7 @@ class TGverify(BaseCog):
             return
         guild_settings = channel.id
         await self.config.guild(guild).welcomechannel.set(guild_settings)
+        self.invalidate_settings(guild)
         msg = "Теперь я буду отправлять приветственные сообщения в {channel}".format(
             channel=channel.mention
         )
@@ -157,6 +194,7 @@ class TGverify(BaseCog):
         """
         try:
             await self.config.guild(ctx.guild).welcomegreeting.set(welcomegreeting)
+            self.invalidate_settings(ctx.guild)
             await ctx.send(f"Приветствие настроено на: `{welcomegreeting}`")
 
         except (ValueError, KeyError, AttributeError):
@@ -169,6 +207,7 @@ class TGverify(BaseCog):
         """
         try:
             await self.config.guild(ctx.guild).disabledgreeting.set(disabledgreeting)
+            self.invalidate_settings(ctx.guild)
             await ctx.send(f"Отключено приветствие, установленное на: `{disabledgreeting}`")
 
         except (ValueError, KeyError, AttributeError):
@@ -181,11 +220,44 @@ class TGverify(BaseCog):
         """
         try:
             await self.config.guild(ctx.guild).bunkerwarning.set(bunkerwarning)
+            self.invalidate_settings(ctx.guild)
             await ctx.send(f"Предупреждение бункера установлено на: `{bunkerwarning}`")
 
         except (ValueError, KeyError, AttributeError):
             await ctx.send("Проблема с установкой предупреждения бункера")
 
+    @config.command()
+    async def welcome_batching(
+        self,
+        ctx,
+        enabled: bool,
+        window: float = 2.0,
+        size: int = 10,
+        max_latency: float = 10.0,
+    ):
+        """
+        Greet members that join close together with a single message
+
+        A batch is sent window seconds after the last join, once it has size members, or max_latency seconds after
+        its first join, whichever comes first. The greeting's {0} then stands for all of them
+        """
+        if window < 0 or size < 1 or max_latency < window:
+            return await ctx.send(
+                "Окно должно быть неотрицательным, размер не меньше 1, а максимальная задержка не меньше окна"
+            )
+        group = self.config.guild(ctx.guild)
+        await group.welcome_batching.set(enabled)
+        await group.welcome_batch_window.set(window)
+        await group.welcome_batch_size.set(size)
+        await group.welcome_batch_latency.set(max_latency)
+        self.invalidate_settings(ctx.guild)
+        if enabled:
+            await ctx.send(
+                f"Приветствия группируются: окно `{window}с`, до `{size}` участников, не дольше `{max_latency}с`"
+            )
+        else:
+            await ctx.send("Группировка приветствий ВЫКЛ")
+
     @tgverify.command()
     async def bunker(self, ctx):
         """
@@ -195,6 +267,7 @@ class TGverify(BaseCog):
             bunker = await self.config.guild(ctx.guild).bunker()
             bunker = not bunker
             await self.config.guild(ctx.guild).bunker.set(bunker)
+            self.invalidate_settings(ctx.guild)
             if bunker:
                 await ctx.send(f"Предупреждение бункера ВКЛ")
             else:
@@ -212,6 +285,7 @@ class TGverify(BaseCog):
             disabled = await self.config.guild(ctx.guild).disabled()
             disabled = not disabled
             await self.config.guild(ctx.guild).disabled.set(disabled)
+            self.invalidate_settings(ctx.guild)
             if disabled:
                 await ctx.send(f"Система верификации теперь ВЫКЛ")
             else:
@@ -231,9 +305,11 @@ class TGverify(BaseCog):
                 return await ctx.send(f"Это неподходящая или недопустимая роль для этого дискорда!")
             if verified_role is None:
                 await self.config.guild(ctx.guild).verified_role.set(None)
+                self.invalidate_settings(ctx.guild)
                 await ctx.send(f"При верификации пользователя роль не будет установлена!")
             else:
                 await self.config.guild(ctx.guild).verified_role.set(verified_role)
+                self.invalidate_settings(ctx.guild)
                 await ctx.send(
                     f"Когда пользователь соответствует минимальной проверке, эта роль будет применена: `{verified_role}`"
                 )
@@ -252,11 +328,13 @@ class TGverify(BaseCog):
                 return await ctx.send(f"Это неподходящая или недопустимая роль для этого дискорда!")
             if verified_living_role is None:
                 await self.config.guild(ctx.guild).verified_living_role.set(None)
+                self.invalidate_settings(ctx.guild)
                 await ctx.send(f"При верификации пользователя роль не будет установлена!")
             else:
                 await self.config.guild(ctx.guild).verified_living_role.set(
                     verified_living_role
                 )
+                self.invalidate_settings(ctx.guild)
                 await ctx.send(
                     f"Когда пользователь соответствует минимальной проверке, эта роль будет применена: `{verified_living_role}`"
                 )
@@ -333,132 +411,279 @@ class TGverify(BaseCog):
                     content=f"У пользователя нету привязанных ckey"
                 )
 
+    @tgverify.group()
+    @checks.admin_or_permissions(administrator=True)
+    async def reverify(self, ctx):
+        """
+        Re-evaluate every member of the discord against the verification rules in the background
+        """
+        pass
+
+    @reverify.command(name="start")
+    async def reverify_start(self, ctx):
+        """
+        Start a fresh reverification run over every member
+        """
+        await self.config.guild(ctx.guild).reverify_cursor.set(0)
+        await self.start_reverify_job(ctx, 0)
+
+    @reverify.command(name="resume")
+    async def reverify_resume(self, ctx):
+        """
+        Carry on a stopped or interrupted reverification run from where it got to
+        """
+        cursor = await self.config.guild(ctx.guild).reverify_cursor()
+        if not cursor:
+            return await ctx.send(
+                "Нет прерванной повторной верификации, используйте `reverify start`"
+            )
+        await self.start_reverify_job(ctx, cursor)
+
+    @reverify.command(name="status")
+    async def reverify_status(self, ctx):
+        """
+        Show the progress of the current reverification run
+        """
+        job = self.reverify_jobs.get(ctx.guild.id)
+        if job is None:
+            return await ctx.send("Повторная верификация не запускалась")
+        await ctx.send(job.progress())
+
+    @reverify.command(name="stop")
+    async def reverify_stop(self, ctx):
+        """
+        Stop the current reverification run, it can be picked up again with resume
+        """
+        job = self.reverify_jobs.get(ctx.guild.id)
+        if job is None or not job.running:
+            return await ctx.send("Повторная верификация не выполняется")
+        job.stop()
+        await ctx.send("Повторная верификация остановлена")
+
+    async def start_reverify_job(self, ctx, cursor: int):
+        job = self.reverify_jobs.get(ctx.guild.id)
+        if job and job.running:
+            return await ctx.send("Повторная верификация уже выполняется")
+
+        settings = await self.settings_for_guild(ctx.guild)
+        if not settings.role or not settings.living_role:
+            raise TGUnrecoverableError(
+                "Роли верификации не настроены, настройте их с помощью конфига"
+            )
+
+        job = ReverifyJob(
+            self,
+            ctx,
+            settings.role,
+            settings.living_role,
+            settings.min_living_minutes,
+            cursor,
+        )
+        self.reverify_jobs[ctx.guild.id] = job
+        job.start()
+
     # Now the only user facing command, so this has rate limiting across the sky
+    # Guild wide bursts are left to the verify queue, which turns people away once it is full
     @commands.cooldown(2, 60, type=commands.BucketType.user)
-    @commands.cooldown(6, 60, type=commands.BucketType.guild)
-    @commands.max_concurrency(3, per=commands.BucketType.guild, wait=False)
     @commands.guild_only()
     @commands.command()
     async def verify(self, ctx, *, one_time_token: str = None):
         """
         Attempt to verify the user, based on the passed in one time code
-        This command is rated limited to two attempts per user every 60 seconds, and 6 attempts per entire discord every 60 seconds
-        """
-        # Get the minimum required living minutes
-        min_required_living_minutes = await self.config.guild(
-            ctx.guild
-        ).min_living_minutes()
-        instructions_link = await self.config.guild(ctx.guild).instructions_link()
-        role = await self.config.guild(ctx.guild).verified_role()
-        verified_role = await self.config.guild(ctx.guild).verified_living_role()
-        role = ctx.guild.get_role(role)
-        verified_role = ctx.guild.get_role(verified_role)
+        This command is rated limited to two attempts per user every 60 seconds
+        """
         tgdb = self.get_tgdb()
-        ckey = None
+        # The token is a secret, so it comes down straight away rather than once the request's turn comes
+        deletion = asyncio.ensure_future(self.delete_token_message(ctx))
+        notice = None
+        shown = None
+
+        async def run(request):
+            if notice is not None:
+                await self.delete_quietly(notice)
+            await self.verify_pipeline(ctx, tgdb, one_time_token, deletion, request)
+
+        async def moved(position):
+            nonlocal shown
+            if notice is None or position == shown:
+                return
+            shown = position
+            try:
+                await notice.edit(
+                    content=f"Вы в очереди на верификацию, позиция: {position}"
+                )
+            except discord.DiscordException:
+                pass
 
-        # First lets try to remove their message, since the one time token is technically a secret if something goes wrong
         try:
-            await ctx.message.delete()
-        except (discord.DiscordException):
-            await ctx.send(
-                "У меня нет необходимых прав для удаления сообщений, пожалуйста, удалите/отредактируйте одноразовый/временный токен вручную."
-            )
-        if not role:
-            raise TGUnrecoverableError(
-                "Роль проверки не настроена, настройте её с помощью конфига"
-            )
-        if not verified_role:
-            raise TGUnrecoverableError(
-                "Роль верификации не настроена для минут жизни, настройте её с помощью конфига"
-            )
-
-        if role in ctx.author.roles and verified_role in ctx.author.roles:
-            return await ctx.send("Вы уже прошли верификацию")
+            queue = await self.verify_queue_for(ctx.guild, tgdb)
+            request = queue.submit(ctx.author.id, run)
+            if not request.started:
+                shown = queue.position(request)
+                try:
+                    notice = await ctx.send(
+                        f"Вы в очереди на верификацию, позиция: {shown}"
+                    )
+                except discord.DiscordException:
+                    pass
+                # Our turn came while the notice was being sent
+                if notice is not None and request.started:
+                    await self.delete_quietly(notice)
+            await queue.wait(request, on_wait=moved)
+        finally:
+            await deletion
+
+    async def verify_queue_for(self, guild, tgdb):
+        """
+        The verify queue for this guild, allowed as many verifies at once as the TGDB pool has connections
+        (less one, so the rest of the bot isn't starved)
+        """
+        settings = await tgdb.settings_for_guild(guild)
+        workers = max(1, settings.pool_maxsize - 1)
+        queue = self.verify_queues.get(guild.id)
+        if queue is None:
+            queue = self.verify_queues[guild.id] = VerifyQueue(workers)
+        elif queue.max_workers != workers:
+            queue.resize(workers)
+        return queue
+
+    async def delete_quietly(self, message):
+        try:
+            await message.delete()
+        except discord.DiscordException:
+            pass
 
-        message = await ctx.send("Пытаюсь верифицировать....")
-        async with ctx.typing():
+    async def verify_pipeline(self, ctx, tgdb, one_time_token: str, deletion, request):
+        """
+        The verify itself, one config read, one query for the token and profile and one transaction for the writes
 
-            if one_time_token:
-                # Attempt to find the user based on the one time token passed in.
-                ckey = await tgdb.lookup_ckey_by_token(ctx, one_time_token)
+        deletion is the token message's deletion, started by verify before the request was queued. The time taken
+        is recorded as the verify operation in TGDB's metrics, from when the request's turn came. TGDB calls are
+        timed on the queue request, so only they count towards slowing the queue down
+        """
+        started = time.perf_counter()
+        try:
+            settings = await self.settings_for_guild(ctx.guild)
+            min_required_living_minutes = settings.min_living_minutes
+            instructions_link = settings.instructions_link
+            role = settings.role
+            verified_role = settings.living_role
+            if not role:
+                raise TGUnrecoverableError(
+                    "Роль проверки не настроена, настройте её с помощью конфига"
+                )
+            if not verified_role:
+                raise TGUnrecoverableError(
+                    "Роль верификации не настроена для минут жизни, настройте её с помощью конфига"
+                )
 
-            prexisting = False
-            # they haven't specified a one time token or it didn't match, see if we already have a linked ckey for the user id that is still valid
-            if ckey is None:
-                discord_link = await tgdb.discord_link_for_discord_id(
-                    ctx, ctx.author.id
+            if role in ctx.author.roles and verified_role in ctx.author.roles:
+                return await ctx.send("Вы уже прошли верификацию")
+
+            message = await ctx.send("Пытаюсь верифицировать....")
+            async with ctx.typing():
+                ckey = None
+                player = None
+                if one_time_token:
+                    # Attempt to find the user and their profile based on the one time token passed in.
+                    with request.in_database():
+                        ckey, player = await tgdb.player_by_token(ctx, one_time_token)
+
+                prexisting = False
+                # they haven't specified a one time token or it didn't match, see if we already have a linked ckey for the user id that is still valid
+                if ckey is None:
+                    with request.in_database():
+                        discord_link = await tgdb.discord_link_for_discord_id(
+                            ctx, ctx.author.id
+                        )
+                    if discord_link and discord_link.valid > 0:
+                        prexisting = True
+                        ckey = discord_link.ckey
+                        # Now look for the user based on the ckey
+                        with request.in_database():
+                            player = await tgdb.get_player_by_ckey(ctx, ckey)
+                    else:
+                        raise TGRecoverableError(
+                            f"Извините {ctx.author} похоже, что у вас нет ckey, привязанного к этой учетной записи discord, вернитесь в игру и попробуйте сгенерировать токен! Посмотрите {instructions_link} для подробной информации. \n\nЕсли после нескольких попыток проблема всё ещё остаётся, обратитесь за поддержкой к Founder, "
+                        )
+
+                log.info(
+                    f"Запрос на верификацию от {ctx.author.id}, для ckey {ckey}, токен был: {one_time_token}"
                 )
-                if discord_link and discord_link.valid > 0:
-                    prexisting = True
-                    ckey = discord_link.ckey
-                    # Now look for the user based on the ckey
-                    # player = await tgdb.get_player_by_ckey(ctx, discord_link.ckey)
-                    # if player and player['living_time'] >= min_required_living_minutes:
-                    #    await ctx.author.add_roles(verified_role, reason="User has verified against their in game living minutes")
-                    # we have a fast path, just reapply the linked role and bail
-                    # await ctx.author.add_roles(role, reason="User has verified in game")
-                    # return await message.edit(content=f"Congrats {ctx.author} your verification is complete")
-                else:
+
+                if player is None:
                     raise TGRecoverableError(
-                        f"Извините {ctx.author} похоже, что у вас нет ckey, привязанного к этой учетной записи discord, вернитесь в игру и попробуйте сгенерировать токен! Посмотрите {instructions_link} для подробной информации. \n\nЕсли после нескольких попыток проблема всё ещё остаётся, обратитесь за поддержкой к Founder, "
+                        f"Извините {ctx.author} похоже, мы не смогли найти вашего пользователя, обратитесь за поддержкой к Founder!"
                     )
 
-            log.info(
-                f"Запрос на верификацию от {ctx.author.id}, для ckey {ckey}, токен был: {one_time_token}"
-            )
-            # Now look for the user based on the ckey
-            player = await tgdb.get_player_by_ckey(ctx, ckey)
+                if not prexisting:
+                    # clear any/all previous valid links for ckey or the discord id (in case they have decided to make a new ckey)
+                    # and record that the user is linked against a discord id, all in one transaction
+                    with request.in_database():
+                        await tgdb.link_discord_account(
+                            ctx, ckey, one_time_token, ctx.author.id
+                        )
+
+                # Both roles go on in one request
+                successful = player.living_time >= min_required_living_minutes
+                if successful:
+                    await ctx.author.add_roles(
+                        role,
+                        verified_role,
+                        reason="Пользователь прошел верификацию в соответствии со своими минутами жизни в игре",
+                    )
+                else:
+                    await ctx.author.add_roles(
+                        role, reason="Пользователь прошел верификацию в игре"
+                    )
 
-            if player is None:
-                raise TGRecoverableError(
-                    f"Извините {ctx.author} похоже, мы не смогли найти вашего пользователя, обратитесь за поддержкой к Founder!"
-                )
+                fuck = f"Поздравляю {ctx.author} ваша верификация завершена, но у вас не прожито достаточное {min_required_living_minutes} минут в игре за члена экипажа (у вас сейчас {player.living_time}). Вы всегда можете пройти верификацию повторно, просто написав `$verify`"
+                if successful:
+                    fuck = f"Поздравляю {ctx.author} верификация завершена"
+                return await message.edit(content=fuck, color=0xFF0000)
+        finally:
+            tgdb.metrics.record("verify", time.perf_counter() - started)
+            await deletion
 
-            if not prexisting:
-                # clear any/all previous valid links for ckey or the discord id (in case they have decided to make a new ckey)
-                await tgdb.clear_all_valid_discord_links_for_ckey(ctx, ckey)
-                await tgdb.clear_all_valid_discord_links_for_discord_id(
-                    ctx, ctx.author.id
+    async def delete_token_message(self, ctx):
+        """
+        Delete the message with the token in it, or ask the user to. Never raises, it runs alongside the verify
+        and is awaited at the end, where an error would replace the verify's own result
+        """
+        try:
+            await ctx.message.delete()
+        except (discord.DiscordException):
+            try:
+                await ctx.send(
+                    "У меня нет необходимых прав для удаления сообщений, пожалуйста, удалите/отредактируйте одноразовый/временный токен вручную."
                 )
-                # Record that the user is linked against a discord id
-                await tgdb.update_discord_link(ctx, one_time_token, ctx.author.id)
-
-            successful = False
-            if role:
-                await ctx.author.add_roles(role, reason="Пользователь прошел верификацию в игре")
-            if player["living_time"] >= min_required_living_minutes:
-                successful = True
-                await ctx.author.add_roles(
-                    verified_role,
-                    reason="Пользователь прошел верификацию в соответствии со своими минутами жизни в игре",
+            except discord.DiscordException:
+                log.warning(
+                    f"Не удалось удалить токен {ctx.author} и попросить удалить его вручную"
                 )
 
-            fuck = f"Поздравляю {ctx.author} ваша верификация завершена, но у вас не прожито достаточное {min_required_living_minutes} минут в игре за члена экипажа (у вас сейчас {player['living_time']}). Вы всегда можете пройти верификацию повторно, просто написав `$verify`"
-            if successful:
-                fuck = f"Поздравляю {ctx.author} верификация завершена"
-            return await message.edit(content=fuck, color=0xFF0000)
-
     @verify.error
     async def verify_error(self, ctx, error):
-        # Our custom, something recoverable went wrong error type
-        if isinstance(error, TGRecoverableError):
+        # The database is busy, nothing is wrong with the request itself so tell them to go again
+        if isinstance(error, TGPoolExhaustedError):
             embed = discord.Embed(
-                title=f"Ошибка верификации:",
+                title=f"База данных сейчас перегружена, попробуйте снова через несколько секунд:",
                 description=f"{format(error)}",
                 color=0xFF0000,
             )
             await ctx.send(content=f"", embed=embed)
+            log.warning(
+                f"Нет свободных соединений с БД для верификации {ctx.author}, discord id {ctx.author.id}"
+            )
 
-        elif isinstance(error, commands.MaxConcurrencyReached):
+        # Our custom, something recoverable went wrong error type
+        elif isinstance(error, TGRecoverableError):
             embed = discord.Embed(
-                title=f"Слишком много верификаций в текущий момент, попробуйте снова через 30 секунд:",
+                title=f"Ошибка верификации:",
                 description=f"{format(error)}",
                 color=0xFF0000,
             )
             await ctx.send(content=f"", embed=embed)
-            log.exception(
-                f"Слишком много пользователей одновременно пытаются пройти верификацию, ожидание БД нарушено?"
-            )
 
         elif isinstance(error, commands.CommandOnCooldown):
             embed = discord.Embed(
@@ -506,8 +731,30 @@ class TGverify(BaseCog):
         guild = member.guild
         if guild is None:
             return
-        channel_id = await self.config.guild(guild).welcomechannel()
-        channel = cast(discord.TextChannel, guild.get_channel(channel_id))
+        settings = await self.settings_for_guild(guild)
+        if settings.welcome_batching:
+            self.welcome_batcher_for(guild, settings).add(member)
+            return
+        await self.send_welcome(guild, [member])
+
+    def welcome_batcher_for(self, guild, settings):
+        batcher = self.welcome_batchers.get(guild.id)
+        if batcher is None:
+            batcher = self.welcome_batchers[guild.id] = WelcomeBatcher(
+                lambda members: self.send_welcome(guild, members)
+            )
+        batcher.window = settings.welcome_batch_window
+        batcher.max_members = settings.welcome_batch_size
+        batcher.max_latency = settings.welcome_batch_latency
+        return batcher
+
+    async def send_welcome(self, guild, members) -> None:
+        """
+        Greet one or more members with a single message, several members share the greeting through a MemberGroup
+        """
+        settings = await self.settings_for_guild(guild)
+        member = members[0] if len(members) == 1 else MemberGroup(members)
+        channel = cast(discord.TextChannel, settings.channel)
         if channel is None:
             log.info(
                 f"Система верификации не обнаружила требуемый канал в дискорд-сервере, вероятно, он был удален. Пользователь присоединился: {member}"
@@ -521,19 +768,32 @@ class TGverify(BaseCog):
             )
             return
 
-        final = ""
-        if await self.config.guild(guild).disabled():
-            msg = await self.config.guild(guild).disabledgreeting()
-            final = msg.format(member, guild)
-        else:
-            msg = await self.config.guild(guild).welcomegreeting()
-            final = msg.format(member, guild)
-        bunkermsg = await self.config.guild(guild).bunkerwarning()
-        bunker = await self.config.guild(guild).bunker()
-        if bunkermsg != "" and bunker:
-            final = final + " " + bunkermsg
-
-        await channel.send(final)
+        await channel.send(settings.greeting(member))
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role) -> None:
+        self.invalidate_settings(role.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel) -> None:
+        self.invalidate_settings(channel.guild)
+
+    async def settings_for_guild(self, guild):
+        """
+        Return the cached ResolvedSettings for this guild, loading them from Config in one read if we don't have them
+        """
+        settings = self._settings.get(guild.id)
+        if settings is None:
+            stored = await self.config.guild(guild).all()
+            settings = ResolvedSettings.from_config(guild, stored)
+            self._settings[guild.id] = settings
+        return settings
+
+    def invalidate_settings(self, guild):
+        """
+        Drop the cached settings for this guild, call after any config change or when a role or channel goes away
+        """
+        self._settings.pop(guild.id, None)
 
     def get_tgdb(self):
         tgdb = self.bot.get_cog("TGDB")
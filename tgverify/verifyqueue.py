@@ -0,0 +1,174 @@
+# Standard Imports
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from tgcommon.errors import (
+    TGDatabaseUnavailableError,
+    TGPoolExhaustedError,
+    TGQueryTimeoutError,
+    TGRecoverableError,
+)
+
+log = logging.getLogger("red.oranges_tgverify.verifyqueue")
+
+# Errors that mean the database is struggling, rather than anything being wrong with the request
+OVERLOAD_ERRORS = (
+    TGPoolExhaustedError,
+    TGQueryTimeoutError,
+    TGDatabaseUnavailableError,
+)
+
+
+class VerifyRequest:
+    __slots__ = ("user_id", "run", "future", "started", "database_seconds")
+
+    def __init__(self, user_id: int, run):
+        self.user_id = user_id
+        self.run = run
+        self.future = asyncio.get_event_loop().create_future()
+        self.started = False
+        self.database_seconds = 0.0
+
+    @contextmanager
+    def in_database(self):
+        """
+        Count the time spent in this block as time waiting on the database
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.database_seconds += time.monotonic() - started
+
+
+class VerifyQueue:
+    """
+    A guild's verify requests, run in arrival order with at most limit of them in flight at once
+
+    Each user can only have one request queued or running, so one impatient user can't crowd everyone else out.
+    The limit starts at max_workers (sized to the TGDB pool) and is halved whenever a verify spends too long in the
+    database or comes back with it overloaded, then grows back by one per quick verify, so a struggling database gets
+    fewer requests instead of more. Only the time run spends inside request.in_database() counts, a slow Discord
+    doesn't hold verifies back. Once maxsize requests are waiting new ones are turned away
+    """
+
+    def __init__(self, max_workers: int, maxsize: int = 50, slow_seconds: float = 5.0):
+        self.max_workers = max_workers
+        self.limit = max_workers
+        self.maxsize = maxsize
+        self.slow_seconds = slow_seconds
+        self.pending = deque()
+        self.users = {}
+        self.running = set()
+
+    def resize(self, max_workers: int):
+        self.max_workers = max(1, max_workers)
+        self.limit = min(self.limit, self.max_workers)
+        self._dispatch()
+
+    def position(self, request: VerifyRequest):
+        """
+        How many requests are ahead of this one, 0 once it is running
+        """
+        if request.started:
+            return 0
+        return self.pending.index(request) + 1
+
+    def submit(self, user_id: int, run):
+        """
+        Queue run (a coroutine function taking the request) for this user, await the returned request's future
+        for its result
+        """
+        if user_id in self.users:
+            raise TGRecoverableError(
+                "Ваша верификация уже в очереди, дождитесь её завершения"
+            )
+        if len(self.pending) >= self.maxsize:
+            raise TGRecoverableError(
+                "Слишком много верификаций в текущий момент, попробуйте снова через 30 секунд"
+            )
+        request = VerifyRequest(user_id, run)
+        self.users[user_id] = request
+        self.pending.append(request)
+        self._dispatch()
+        return request
+
+    async def wait(self, request: VerifyRequest, on_wait=None, interval: float = 5.0):
+        """
+        The request's result once it has run, while it is still waiting on_wait (a coroutine function, if given)
+        is called with its position every interval seconds
+        """
+        try:
+            while on_wait is not None and not request.started:
+                try:
+                    return await asyncio.wait_for(
+                        asyncio.shield(request.future), interval
+                    )
+                except asyncio.TimeoutError:
+                    if not request.started:
+                        await on_wait(self.position(request))
+            return await request.future
+        finally:
+            # The caller gave up before its turn came, don't leave it in the queue
+            if not request.started and request in self.pending:
+                self.pending.remove(request)
+                self.users.pop(request.user_id, None)
+
+    def _dispatch(self):
+        while self.pending and len(self.running) < self.limit:
+            request = self.pending.popleft()
+            request.started = True
+            task = asyncio.ensure_future(self._run(request))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _run(self, request: VerifyRequest):
+        error = None
+        try:
+            result = await request.run(request)
+        except Exception as e:
+            error = e
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            if not request.future.done():
+                # Cancelled by close, let the waiting verify know it isn't coming
+                request.future.cancel()
+            self.users.pop(request.user_id, None)
+            self._adjust(request.database_seconds, error)
+            # Our own task is still counted as running until this returns
+            self.running.discard(asyncio.current_task())
+            self._dispatch()
+
+    def _adjust(self, elapsed: float, error: BaseException = None):
+        if isinstance(error, OVERLOAD_ERRORS) or elapsed >= self.slow_seconds:
+            limit = max(1, self.limit // 2)
+            if limit < self.limit:
+                log.info(
+                    f"База данных отвечает медленно ({elapsed:.1f}с на верификацию), одновременно теперь {limit}"
+                )
+            self.limit = limit
+        elif elapsed < self.slow_seconds / 2 and self.limit < self.max_workers:
+            self.limit += 1
+
+    def stats(self):
+        return {
+            "queued": len(self.pending),
+            "running": len(self.running),
+            "limit": self.limit,
+            "max_workers": self.max_workers,
+        }
+
+    def close(self):
+        for task in list(self.running):
+            task.cancel()
+        for request in self.pending:
+            request.future.cancel()
+        self.pending.clear()
+        self.users.clear()
@@ -0,0 +1,87 @@
+# Standard Imports
+import asyncio
+import logging
+import time
+
+log = logging.getLogger("red.oranges_tgverify.welcomes")
+
+
+class MemberGroup:
+    """
+    Stands in for the member when several joins share one greeting, so the same template works for both.
+    Any attribute comes back as every member's value joined up, {0.mention} mentions everyone and {0} names everyone
+    """
+
+    def __init__(self, members):
+        self.members = members
+
+    @property
+    def guild(self):
+        return self.members[0].guild
+
+    def __getattr__(self, name):
+        return ", ".join(str(getattr(member, name)) for member in self.members)
+
+    def __str__(self):
+        return ", ".join(str(member) for member in self.members)
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+
+class WelcomeBatcher:
+    """
+    Collects a guild's joins and greets them with one message instead of one each
+
+    A batch goes out window seconds after the latest join, as soon as it has max_members members, and never
+    later than max_latency seconds after its first join however steadily people keep arriving
+    """
+
+    def __init__(
+        self,
+        send,
+        window: float = 2.0,
+        max_members: int = 10,
+        max_latency: float = 10.0,
+    ):
+        self.send = send
+        self.window = window
+        self.max_members = max_members
+        self.max_latency = max_latency
+        self.members = []
+        self.first = None
+        self.timer = None
+
+    def add(self, member):
+        now = time.monotonic()
+        self.members.append(member)
+        if self.first is None:
+            self.first = now
+        if len(self.members) >= self.max_members:
+            delay = 0
+        else:
+            delay = max(0, min(self.window, self.first + self.max_latency - now))
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = asyncio.ensure_future(self._flush_after(delay))
+
+    async def _flush_after(self, delay: float):
+        await asyncio.sleep(delay)
+        # From here on a new join starts a new batch instead of cancelling this send
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        members, self.members, self.first = self.members, [], None
+        for start in range(0, len(members), self.max_members):
+            try:
+                await self.send(members[start : start + self.max_members])
+            except Exception:
+                log.exception("Не удалось отправить приветствие")
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.members = []
+        self.first = None